@@ -2,14 +2,18 @@ from fastapi import FastAPI
 from contextlib import asynccontextmanager
 from fastapi.middleware.cors import CORSMiddleware
 from .database import engine, Base
-from .routers import stories, auth
+from .routers import stories, auth, pipeline
 from .scheduler import start_scheduler
+from .services.ingestion import shutdown_parse_pool
+from .services.clustering import shutdown_cluster_pool
+from .scripts.migrate_db import add_missing_columns
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup: create tables
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(add_missing_columns)
     
     # Start scheduler
     scheduler = start_scheduler()
@@ -17,6 +21,8 @@ async def lifespan(app: FastAPI):
     yield
     # Shutdown
     scheduler.shutdown()
+    shutdown_parse_pool()
+    shutdown_cluster_pool()
 
 app = FastAPI(title="AI Daily API", lifespan=lifespan)
 
@@ -45,6 +51,7 @@ app.add_middleware(
 
 app.include_router(stories.router)
 app.include_router(auth.router)
+app.include_router(pipeline.router)
 
 @app.get("/")
 def read_root():
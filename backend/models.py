@@ -1,10 +1,14 @@
-from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, Text, DateTime, Float, Enum as SQLEnum, JSON, ARRAY
-from sqlalchemy.orm import relationship
+from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, Text, DateTime, Float, Enum as SQLEnum, JSON, ARRAY, LargeBinary
+from sqlalchemy.orm import relationship, deferred
 from sqlalchemy.sql import func
-from sqlalchemy.dialects.postgresql import UUID
+# Generic Uuid: native UUID on Postgres, CHAR(32) on SQLite (a column declared "UUID" gets numeric
+# affinity there, which mangles hex ids that look like numbers, e.g. "123e4...")
+from sqlalchemy import Uuid as UUID
 import uuid
 import enum
 from .database import Base
+from .services.normalize import decompress_text
+from .services.lsh import LSH_VERSION
 
 class Persona(str, enum.Enum):
     builders = "builders"
@@ -46,6 +50,20 @@ class Source(Base):
     feed_url = Column(String)
     trust_level = Column(SQLEnum(TrustLevel), default=TrustLevel.medium)
     fetch_method = Column(String, default="rss") # rss, api
+
+    # HTTP validators from the last successful fetch, used for conditional GETs
+    etag = Column(String, nullable=True)
+    last_modified = Column(String, nullable=True)
+    content_hash = Column(String, nullable=True) # sha256 of the last body we parsed
+
+    # Ingestion watermark: newest entry seen so far, parsing stops once it reaches these
+    last_seen_published_at = Column(DateTime(timezone=True), nullable=True)
+    last_seen_guid = Column(String, nullable=True)
+
+    # Adaptive polling: learned cadence, failure backoff and when the source is next due
+    poll_interval_minutes = Column(Float, nullable=True)
+    consecutive_failures = Column(Integer, default=0)
+    next_poll_at = Column(DateTime(timezone=True), nullable=True)
     
     items = relationship("Item", back_populates="source")
 
@@ -57,7 +75,10 @@ class Item(Base):
     title = Column(String)
     url = Column(String)
     published_at = Column(DateTime(timezone=True))
-    raw_text = Column(Text, nullable=True) # Full text or abstract
+    raw_text = Column(Text, nullable=True) # Legacy: raw feed HTML, only set on rows ingested before normalization
+    excerpt = Column(Text, nullable=True) # Short plain-text excerpt, cheap to read
+    body_compressed = deferred(Column(LargeBinary, nullable=True)) # zlib'd full plain text; undefer() when you need it
+    content_fingerprint = Column(String, nullable=True) # sha1 of the normalized text
     content_type = Column(String, nullable=True)
     hash = Column(String, unique=True, index=True) # For deduplication
     metadata_json = Column(JSON, nullable=True)
@@ -67,9 +88,16 @@ class Item(Base):
     # Simplified: We'll store the link in 'Story' json for now or create a StoryItem link table.
     # For MVP, let's assume we copy item data into context or link them. 
     # Let's add a FK for simple clustering.
-    story_id = Column(UUID(as_uuid=True), ForeignKey("stories.id"), nullable=True)
+    story_id = Column(UUID(as_uuid=True), ForeignKey("stories.id"), nullable=True, index=True)
     story = relationship("Story", back_populates="items")
 
+    @property
+    def body(self):
+        """Full plain text. Needs body_compressed loaded (undefer) in async code."""
+        if self.body_compressed:
+            return decompress_text(self.body_compressed)
+        return self.raw_text or ""
+
 class Story(Base):
     __tablename__ = "stories"
 
@@ -77,7 +105,12 @@ class Story(Base):
     canonical_title = Column(String)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     tags = Column(JSON, default=list) # List of strings
-    score = Column(Float, default=0.0)
+    score = Column(Float, default=0.0, index=True) # Hot score maintained by services/ranking.py; rank by it
+    item_count = Column(Integer, default=0)
+    source_count = Column(Integer, default=0)
+    needs_split = Column(Boolean, default=False) # Set by compaction when members drifted apart
+    classification = Column(JSON, nullable=True) # Persona/category targets from the relevance call
+    classification_key = Column(String, nullable=True) # Item-set hash the classification was made from
     
     items = relationship("Item", back_populates="story")
     summaries = relationship("StorySummary", back_populates="story")
@@ -116,3 +149,51 @@ class UserPreferences(Base):
     preferred_source_ids = Column(JSON, default=list)
     
     user = relationship("User", back_populates="preferences")
+
+class PipelineRun(Base):
+    __tablename__ = "pipeline_runs"
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    status = Column(String, default="running") # running, completed, failed, abandoned
+    current_stage = Column(String, nullable=True) # ingest, cluster, summarize
+    stage_totals = Column(JSON, default=dict) # {stage: units of work}, for progress reporting
+    started_at = Column(DateTime(timezone=True), server_default=func.now())
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+
+    checkpoints = relationship("PipelineCheckpoint", back_populates="run")
+
+class PipelineCheckpoint(Base):
+    __tablename__ = "pipeline_checkpoints"
+
+    # One row per completed unit of work: a source (ingest), the batch (cluster) or a story (summarize)
+    run_id = Column(UUID(as_uuid=True), ForeignKey("pipeline_runs.id"), primary_key=True)
+    stage = Column(String, primary_key=True)
+    unit_key = Column(String, primary_key=True)
+    completed_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    run = relationship("PipelineRun", back_populates="checkpoints")
+
+class StoryIndexEntry(Base):
+    __tablename__ = "story_index"
+
+    # Compact, clustering-only view of a recent story, so clustering never loads the Story/Item graph
+    story_id = Column(UUID(as_uuid=True), ForeignKey("stories.id"), primary_key=True)
+    canonical_title = Column(String)
+    bands = Column(JSON, default=list) # LSH band keys of the story's member titles (capped)
+    centroid = Column(JSON, nullable=True) # {term: weight} summed over members' titles + excerpts (top terms)
+    created_at = Column(DateTime(timezone=True), index=True) # Copy of Story.created_at, drives eviction
+    updated_at = Column(DateTime(timezone=True), nullable=True)
+    dirty = Column(Boolean, default=True, index=True) # Touched by clustering since the last compaction
+    lsh_version = Column(Integer, default=LSH_VERSION) # Banding the bands were computed with; NULL = 1
+
+class LLMCacheEntry(Base):
+    __tablename__ = "llm_cache"
+
+    # sha256 of model + prompt version + normalized input; see services/llm_cache.py
+    key = Column(String, primary_key=True)
+    kind = Column(String) # classify, summary
+    model = Column(String)
+    response = Column(JSON) # Parsed model output
+    created_at = Column(DateTime(timezone=True)) # Drives TTL expiry
+    last_used_at = Column(DateTime(timezone=True), index=True) # Drives LRU eviction
+    hits = Column(Integer, default=0)
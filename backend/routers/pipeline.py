@@ -0,0 +1,48 @@
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+from typing import List
+from uuid import UUID
+
+from ..database import get_db
+from ..models import PipelineRun
+from ..services.pipeline import run_progress
+from .. import schemas
+
+router = APIRouter(
+    prefix="/pipeline",
+    tags=["pipeline"],
+)
+
+STAGES = ["ingest", "cluster", "summarize"]
+
+def to_schema(run, progress):
+    totals = run.stage_totals or {}
+    done = progress.get(run.id, {})
+    return schemas.PipelineRun(
+        id=run.id,
+        status=run.status,
+        current_stage=run.current_stage,
+        started_at=run.started_at,
+        finished_at=run.finished_at,
+        stages=[
+            schemas.PipelineStageProgress(stage=stage, completed=done.get(stage, 0), total=totals.get(stage))
+            for stage in STAGES if stage in totals or stage in done
+        ]
+    )
+
+@router.get("/runs", response_model=List[schemas.PipelineRun])
+async def list_runs(limit: int = 20, db: AsyncSession = Depends(get_db)):
+    result = await db.execute(select(PipelineRun).order_by(PipelineRun.started_at.desc()).limit(limit))
+    runs = result.scalars().all()
+    progress = await run_progress(db, [r.id for r in runs])
+    return [to_schema(r, progress) for r in runs]
+
+@router.get("/runs/{run_id}", response_model=schemas.PipelineRun)
+async def get_run(run_id: UUID, db: AsyncSession = Depends(get_db)):
+    result = await db.execute(select(PipelineRun).where(PipelineRun.id == run_id))
+    run = result.scalars().first()
+    if not run:
+        raise HTTPException(status_code=404, detail="Pipeline run not found")
+    progress = await run_progress(db, [run.id])
+    return to_schema(run, progress)
@@ -14,8 +14,8 @@ router = APIRouter(
     tags=["stories"],
 )
 
-from sqlalchemy import func
-from ..models import Item, UserSave
+from sqlalchemy import func, and_
+from ..models import UserSave
 
 @router.get("/debug/status")
 async def debug_status(db: AsyncSession = Depends(get_db)):
@@ -62,27 +62,24 @@ async def get_stories(
     
 
 
-    # Query stories
-    # Join with StorySummary for filtering and Item for signal ranking
-    stmt = (
-        select(Story)
-        .outerjoin(StorySummary)
-        .outerjoin(Item)
-        .where(Story.created_at >= start_date)
-    )
+    # Query stories, ranked by the maintained score (an index scan, no aggregation)
+    stmt = select(Story).where(Story.created_at >= start_date)
 
+    # Both filters apply to the same summary row
+    summary_filters = []
     if persona:
         # Use the enum value if possible or ensure comparison works
-        stmt = stmt.where(StorySummary.persona == persona)
+        summary_filters.append(StorySummary.persona == persona)
     
     if category:
-        stmt = stmt.where(StorySummary.category == category)
+        summary_filters.append(StorySummary.category == category)
+
+    if summary_filters:
+        stmt = stmt.where(Story.summaries.any(and_(*summary_filters)))
 
-    # Rank by item count (signal)
     stmt = (
-        stmt.group_by(Story.id)
-        .options(selectinload(Story.items), selectinload(Story.summaries))
-        .order_by(Story.created_at.desc(), func.count(Item.id).desc())
+        stmt.options(selectinload(Story.items), selectinload(Story.summaries))
+        .order_by(Story.score.desc())
         .limit(20 if timeframe == "today" else 30)
     )
     
@@ -1,31 +1,92 @@
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 import asyncio
+import os
+from .database import SessionLocal
 from .services.ingestion import fetch_and_process_feeds
 from .services.clustering import cluster_items
 from .services.llm import summarize_stories
+from .services.polling import due_source_ids
+from .services.compaction import compact_stories
+from .services import pipeline
 import logging
 
 logger = logging.getLogger(__name__)
 
+# "adaptive": poll each source on its own learned interval; "fixed": whole pipeline hourly
+POLLING_MODE = os.getenv("POLLING_MODE", "adaptive")
+POLL_TICK_MINUTES = int(os.getenv("POLL_TICK_MINUTES", "5"))
+COMPACTION_INTERVAL_MINUTES = int(os.getenv("COMPACTION_INTERVAL_MINUTES", "30"))
+
+# Only one pipeline run at a time in this process (scheduler tick vs manual /run-pipeline)
+_pipeline_lock = asyncio.Lock()
+
+async def run_pipeline(source_ids=None, skip_if_no_new_items=False):
+    """Run ingest -> cluster -> summarize as a checkpointed pipeline run.
+
+    If the previous run crashed midway, it is resumed: finished sources and finished stories are
+    skipped instead of being redone. Clustering always runs, over whatever is still unclustered.
+    """
+    if _pipeline_lock.locked():
+        logger.info("Pipeline already running, skipping")
+        return
+
+    async with _pipeline_lock:
+        run_id, resumed = await pipeline.start_or_resume_run()
+        try:
+            logger.info("Step 1: Ingestion")
+            new_item_ids = await fetch_and_process_feeds(source_ids, run_id=run_id)
+
+            if resumed:
+                # Items ingested before the crash aren't in new_item_ids; cluster everything unclustered
+                new_item_ids = None
+            elif skip_if_no_new_items and not new_item_ids:
+                await pipeline.finish_run(run_id)
+                return
+
+            logger.info("Step 2: Clustering")
+            await cluster_items(new_item_ids, run_id=run_id)
+
+            logger.info("Step 3: Summarization")
+            await summarize_stories(run_id=run_id)
+        except Exception:
+            await pipeline.finish_run(run_id, "failed")
+            raise
+
+        await pipeline.finish_run(run_id)
+
 async def full_pipeline():
     logger.info("Starting Full Pipeline Run")
-    logger.info("Step 1: Ingestion")
-    await fetch_and_process_feeds()
-    
-    logger.info("Step 2: Clustering")
-    await cluster_items()
-    
-    logger.info("Step 3: Summarization")
-    await summarize_stories()
-    
+    await run_pipeline()
     logger.info("Pipeline Complete")
 
+async def poll_due_sources():
+    """Fetch only the sources whose next poll is due; run downstream stages only if something arrived."""
+    async with SessionLocal() as session:
+        source_ids = await due_source_ids(session)
+    if not source_ids:
+        return
+
+    logger.info(f"Polling {len(source_ids)} due sources")
+    await run_pipeline(source_ids, skip_if_no_new_items=True)
+
+async def compact():
+    """Merge/split pass over recently touched stories; never overlaps a pipeline run."""
+    if _pipeline_lock.locked():
+        logger.info("Pipeline running, skipping compaction")
+        return
+
+    async with _pipeline_lock:
+        await compact_stories()
+
 def start_scheduler():
     scheduler = AsyncIOScheduler()
-    # Schedule daily at 6 AM ET (approx 10 AM UTC)
-    # For testing, we run every hour or manual trigger
-    # Schedule to run every hour to keep feed fresh
-    scheduler.add_job(full_pipeline, 'interval', minutes=60) 
+    if POLLING_MODE == "fixed":
+        # Schedule to run every hour to keep feed fresh
+        scheduler.add_job(full_pipeline, 'interval', minutes=60)
+    else:
+        # A cheap tick; each source decides for itself whether it is due
+        scheduler.add_job(poll_due_sources, 'interval', minutes=POLL_TICK_MINUTES, max_instances=1, coalesce=True)
+    scheduler.add_job(compact, 'interval', minutes=COMPACTION_INTERVAL_MINUTES, max_instances=1, coalesce=True)
     scheduler.start()
     return scheduler
 
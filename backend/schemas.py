@@ -99,3 +99,17 @@ class User(UserBase):
 class Token(BaseModel):
     access_token: str
     token_type: str
+
+# --- Pipeline Runs ---
+class PipelineStageProgress(BaseModel):
+    stage: str
+    completed: int
+    total: Optional[int] = None
+
+class PipelineRun(BaseModel):
+    id: UUID
+    status: str
+    current_stage: Optional[str] = None
+    started_at: datetime
+    finished_at: Optional[datetime] = None
+    stages: List[PipelineStageProgress] = []
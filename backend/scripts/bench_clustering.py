@@ -0,0 +1,275 @@
+"""Offline clustering quality and speed benchmark.
+
+Builds a labeled corpus of AI-news titles where each story is covered by several sources with
+differently worded headlines, loads it into a scratch SQLite database and runs cluster_items on
+it, reporting items/sec, peak memory and pair-level precision/recall/F1 against the labels.
+
+    python -m backend.scripts.bench_clustering
+    python -m backend.scripts.bench_clustering --sizes 1000,10000 --thresholds 0.55,0.65,0.75
+    python -m backend.scripts.bench_clustering --backends sequence,tfidf --batch-size 1000
+    python -m backend.scripts.bench_clustering --backends tfidf --thresholds 0.65 --compact
+    python -m backend.scripts.bench_clustering --sizes 100000 --workers 8
+    python -m backend.scripts.bench_clustering --corpus recorded_titles.jsonl
+
+The synthetic corpus mixes model launches, funding rounds and papers. Stories share companies,
+products and vocabulary, so near-miss headlines about different stories are common. A recorded
+corpus is a JSONL file of {"title": ..., "excerpt": ..., "label": ...} lines. Items with the same
+label belong to the same story. Sizes larger than the recorded corpus are capped to it.
+
+Pair-level metrics count item pairs: a true positive is a pair placed in the same story that
+shares a label. Peak memory is the process's peak RSS, so run sizes in ascending order (the
+default) or one size per invocation. The sequence backend is slow on large templated corpora;
+expect the 100k run to take a while.
+
+WARNING: the target database is dropped and recreated. Only point --db at a scratch database.
+"""
+import argparse
+import os
+
+parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+parser.add_argument("--db", default="sqlite+aiosqlite:///./bench_clustering.db", help="Scratch database URL (dropped!)")
+parser.add_argument("--sizes", default="1000,10000,100000", help="Comma-separated corpus sizes")
+parser.add_argument("--backends", default="sequence", help="Comma-separated clustering backends to compare")
+parser.add_argument("--thresholds", help="Comma-separated thresholds to sweep (default: the backend's configured one)")
+parser.add_argument("--batch-size", type=int, default=0, help="Cluster in batches of this many items, like repeated pipeline runs (0 = one batch)")
+parser.add_argument("--workers", type=int, default=0, help="CLUSTER_WORKERS for the run (0 = serial)")
+parser.add_argument("--compact", action="store_true", help="Run a merge/split compaction pass after clustering (timed with it)")
+parser.add_argument("--corpus", help="Recorded JSONL corpus to use instead of the synthetic one")
+parser.add_argument("--seed", type=int, default=7)
+args = parser.parse_args()
+
+# backend.database reads DATABASE_URL at import time
+os.environ["DATABASE_URL"] = args.db
+
+import asyncio
+import json
+import logging
+import random
+import resource
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timedelta
+from sqlalchemy import insert
+from sqlalchemy.future import select
+from backend.database import engine, Base, SessionLocal
+from backend.models import Item, Source, SourceType, TrustLevel
+from backend.services import clustering
+from backend.services.compaction import compact_stories, reset_window_state
+
+OUTLETS = ["TechCrunch", "The Verge", "VentureBeat", "Wired", "Reuters", "Ars Technica", "Bloomberg", "MIT Tech Review"]
+COMPANIES = [
+    "OpenAI", "Anthropic", "Google DeepMind", "Meta", "Mistral", "Microsoft", "Nvidia", "Apple", "Amazon",
+    "Cohere", "xAI", "Alibaba", "DeepSeek", "Stability AI", "Hugging Face", "IBM", "Salesforce", "Databricks",
+]
+MODEL_SUFFIXES = ["", " Pro", " Mini", " Turbo", " Flash", " Ultra"]
+FEATURES = [
+    "for code generation", "with a 1M-token context window", "for on-device inference", "with native tool use",
+    "for enterprise search", "with real-time voice", "for scientific reasoning", "with open weights",
+    "for video generation", "for customer support", "with image understanding", "for drug discovery",
+    "for spreadsheet analysis", "with built-in web browsing", "for robotics control", "for medical imaging",
+]
+SYLLABLES = ["ka", "lo", "ri", "ven", "tra", "mi", "zo", "pex", "qua", "nel", "dor", "sy", "fin", "ax", "or", "lum", "bri", "tek", "sol", "ga"]
+ROUNDS = ["seed", "Series A", "Series B", "Series C"]
+PRODUCTS = [
+    "AI agents", "coding assistants", "robotics foundation models", "AI chips", "legal copilots", "synthetic data",
+    "inference infrastructure", "voice agents", "AI search", "model evaluation", "GPU clouds", "clinical AI",
+]
+METHOD_KINDS = ["attention", "decoding", "distillation", "preference tuning", "routing", "retrieval", "quantization", "search"]
+TASKS = [
+    "long-context reasoning", "math word problems", "code repair", "multilingual translation", "protein design",
+    "agent planning", "table question answering", "theorem proving", "speech recognition", "video understanding",
+]
+FILLER = [
+    "The company said the rollout starts this week.", "Early benchmarks suggest strong gains.",
+    "Analysts expect competitors to respond.", "Pricing was not disclosed.", "The team published a technical report.",
+    "Developers can try it through the API.", "Critics raised safety concerns.",
+]
+
+LAUNCH_TITLES = [
+    "{c} launches {p} {f}",
+    "{c} unveils {p}, its new model {f}",
+    "{c} releases {p} {f}",
+    "{p}: {c}'s latest model arrives {f}",
+    "Hands-on with {p}, {c}'s new model {f}",
+    "{c} announces {p} | {o}",
+    "Breaking: {c} debuts {p} {f}",
+]
+FUNDING_TITLES = [
+    "{s} raises ${a}M {r} to build {t}",
+    "{s} lands ${a} million in {r} funding for {t}",
+    "AI startup {s} secures ${a}M {r}",
+    "{t} startup {s} closes ${a}M {r} round",
+    "Exclusive: {s} raises ${a}M for {t} | {o}",
+]
+PAPER_TITLES = [
+    "{m} improves {t}",
+    "Researchers propose {m} for {t}",
+    "New paper: {m} sets state of the art on {t}",
+    "How {m} helps with {t}",
+    "{m} for {t} (arXiv)",
+]
+
+def startup_name(rng):
+    return "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 3))).capitalize()
+
+def method_name(rng):
+    return "".join(rng.choice(SYLLABLES) for _ in range(2)).upper() + " " + rng.choice(METHOD_KINDS)
+
+def story_fields(rng):
+    """Templates plus the entities of one story. Generated names keep distinct stories distinct,
+    while shared companies, templates and topics keep near-miss headlines common."""
+    kind = rng.choices(["launch", "funding", "paper"], weights=[5, 3, 2])[0]
+    if kind == "launch":
+        product = f"{startup_name(rng)} {rng.randint(1, 9)}{rng.choice(MODEL_SUFFIXES)}"
+        return LAUNCH_TITLES, {"c": rng.choice(COMPANIES), "p": product, "f": rng.choice(FEATURES)}
+    if kind == "funding":
+        return FUNDING_TITLES, {"s": startup_name(rng), "a": rng.choice([5, 12, 20, 40, 75, 120, 300]), "r": rng.choice(ROUNDS), "t": rng.choice(PRODUCTS)}
+    return PAPER_TITLES, {"m": method_name(rng), "t": rng.choice(TASKS)}
+
+def synthetic_corpus(size, seed):
+    """Labeled (title, excerpt, label) rows in arrival order; each story is covered 1-8 times."""
+    rng = random.Random(seed)
+    rows = []
+    label = 0
+    start = datetime(2025, 6, 1)
+    while len(rows) < size:
+        templates, fields = story_fields(rng)
+        published = start + timedelta(minutes=label * 5)
+        coverage = min(rng.choice([1, 1, 2, 3, 3, 4, 5, 6, 8]), size - len(rows))
+        for _ in range(coverage):
+            title = rng.choice(templates).format(o=rng.choice(OUTLETS), **fields)
+            lead = title.split(" | ")[0]
+            excerpt = f"{lead}. {rng.choice(FILLER)}"
+            # Coverage trickles in over a few hours
+            rows.append((published + timedelta(minutes=rng.randint(0, 360)), title, excerpt, label))
+        label += 1
+    rows.sort(key=lambda row: row[0])
+    return [(title, excerpt, label) for _, title, excerpt, label in rows]
+
+def recorded_corpus(path, size):
+    rows = []
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                rows.append((record["title"], record.get("excerpt"), record["label"]))
+    return rows[:size]
+
+def pairs(n):
+    return n * (n - 1) // 2
+
+def pair_scores(labels, predicted):
+    """Pair-level precision/recall/F1 from label x cluster co-occurrence counts."""
+    together = sum(pairs(n) for n in Counter(zip(labels, predicted)).values())
+    predicted_pairs = sum(pairs(n) for n in Counter(predicted).values())
+    true_pairs = sum(pairs(n) for n in Counter(labels).values())
+    precision = together / predicted_pairs if predicted_pairs else 1.0
+    recall = together / true_pairs if true_pairs else 1.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return precision, recall, f1
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 # KB on Linux
+
+async def prepare_corpus(corpus):
+    """Fresh schema and sources; returns the corpus as Item rows, not yet inserted."""
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+    # Compaction keeps window state per process; this is a new database
+    reset_window_state()
+
+    async with SessionLocal() as session:
+        sources = [
+            Source(name=outlet, type=SourceType.news, trust_level=TrustLevel.medium, feed_url=f"http://127.0.0.1/{i}")
+            for i, outlet in enumerate(OUTLETS)
+        ]
+        session.add_all(sources)
+        await session.flush()
+
+        now = datetime.utcnow()
+        rows = [
+            {
+                "id": uuid.uuid4(),
+                "source_id": sources[i % len(sources)].id,
+                "title": title,
+                "excerpt": excerpt,
+                "url": f"https://example.com/{i}",
+                "published_at": now + timedelta(seconds=i), # Arrival order
+                "hash": f"bench-{i}",
+            }
+            for i, (title, excerpt, _) in enumerate(corpus)
+        ]
+        await session.commit()
+    return rows
+
+async def insert_rows(rows):
+    async with SessionLocal() as session:
+        for i in range(0, len(rows), 5000):
+            await session.execute(insert(Item), rows[i:i + 5000])
+        await session.commit()
+
+async def run_once(corpus, backend, threshold):
+    rows = await prepare_corpus(corpus)
+    item_ids = [row["id"] for row in rows]
+
+    # cluster_items reads these module settings on every call
+    clustering.CLUSTERING_BACKEND = backend
+    clustering.CLUSTER_WORKERS = args.workers
+    if backend == "tfidf":
+        clustering.TFIDF_SIMILARITY_THRESHOLD = threshold
+    else:
+        clustering.SIMILARITY_THRESHOLD = threshold
+
+    # Each batch is inserted just before it is clustered, like ingestion followed by clustering;
+    # unclustered items already in the table would be swept into the current batch
+    batch_size = args.batch_size or len(item_ids)
+    elapsed = 0.0
+    for i in range(0, len(item_ids), batch_size):
+        await insert_rows(rows[i:i + batch_size])
+        started = time.perf_counter()
+        await clustering.cluster_items(item_ids[i:i + batch_size])
+        elapsed += time.perf_counter() - started
+    if args.compact:
+        started = time.perf_counter()
+        await compact_stories()
+        elapsed += time.perf_counter() - started
+
+    async with SessionLocal() as session:
+        result = await session.execute(select(Item.id, Item.story_id))
+        story_of = dict(result.all())
+    predicted = [story_of[item_id] for item_id in item_ids]
+    labels = [label for _, _, label in corpus]
+    return elapsed, len(set(predicted)), pair_scores(labels, predicted)
+
+async def bench():
+    sizes = [int(s) for s in args.sizes.split(",")]
+    backends = args.backends.split(",")
+    thresholds = [float(t) for t in args.thresholds.split(",")] if args.thresholds else [None]
+    defaults = {name: clustering.SIMILARITY_THRESHOLD for name in clustering.PLANNERS}
+    defaults["tfidf"] = clustering.TFIDF_SIMILARITY_THRESHOLD
+
+    print(f"Corpus: {args.corpus or 'synthetic'}, DB: {args.db}, batch size: {args.batch_size or 'all'}, workers: {args.workers}, compaction: {'on' if args.compact else 'off'}\n")
+    print(f"{'ITEMS':>7} | {'BACKEND':<8} | {'THRESH':>6} | {'SECONDS':>8} | {'ITEMS/S':>8} | {'STORIES':>7} | {'TRUE':>7} | {'PREC':>5} | {'RECALL':>6} | {'F1':>5} | {'PEAK RSS MB':>11}")
+    print("-" * 106)
+    for size in sizes:
+        corpus = recorded_corpus(args.corpus, size) if args.corpus else synthetic_corpus(size, args.seed)
+        true_stories = len({label for _, _, label in corpus})
+        for backend in backends:
+            for threshold in thresholds:
+                if threshold is None:
+                    threshold = defaults[backend]
+                elapsed, stories, (precision, recall, f1) = await run_once(corpus, backend, threshold)
+                print(
+                    f"{len(corpus):>7} | {backend:<8} | {threshold:>6.2f} | {elapsed:>8.2f} | {len(corpus) / elapsed:>8.0f} | "
+                    f"{stories:>7} | {true_stories:>7} | {precision:>5.3f} | {recall:>6.3f} | {f1:>5.3f} | {peak_rss_mb():>11.1f}"
+                )
+
+    clustering.shutdown_cluster_pool()
+    await engine.dispose()
+
+if __name__ == "__main__":
+    # cluster_items logs every assignment at INFO
+    logging.basicConfig(level=logging.WARNING)
+    asyncio.run(bench())
@@ -0,0 +1,203 @@
+"""Offline ingestion benchmark.
+
+Serves feed fixtures for every source in seed_sources.py from a local HTTP stand-in and runs
+fetch_and_process_feeds against a scratch database, reporting feeds/sec, entries/sec, DB round
+trips and peak RSS per run.
+
+    python -m backend.scripts.bench_ingestion --runs 3
+    python -m backend.scripts.bench_ingestion --fixtures ./recorded_feeds --db postgresql://.../scratch
+
+Fixtures are synthesized per source unless --fixtures has a recorded <slug>.xml for it. The mix
+covers large arXiv dumps, slow hosts, servers answering 304, an Atom feed and a malformed feed.
+Run 1 is a cold ingest; later runs add a few new entries to the plain feeds so the watermark,
+conditional GET and unchanged-body paths are all exercised.
+
+WARNING: the target database is dropped and recreated. Only point --db at a scratch database.
+"""
+import argparse
+import os
+import re
+
+parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+parser.add_argument("--db", default="sqlite+aiosqlite:///./bench_ingestion.db", help="Scratch database URL (dropped!)")
+parser.add_argument("--runs", type=int, default=2)
+parser.add_argument("--fixtures", help="Directory of recorded <slug>.xml feeds to serve instead of synthetic ones")
+parser.add_argument("--arxiv-entries", type=int, default=2000)
+parser.add_argument("--blog-entries", type=int, default=30)
+parser.add_argument("--new-per-run", type=int, default=5)
+parser.add_argument("--slow-delay", type=float, default=2.0, help="Seconds the slow hosts take to respond")
+args = parser.parse_args()
+
+# backend.database reads DATABASE_URL at import time
+os.environ["DATABASE_URL"] = args.db
+
+import asyncio
+import resource
+import threading
+import time
+from datetime import datetime, timedelta
+from email.utils import format_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from xml.sax.saxutils import escape
+from sqlalchemy import event
+from backend.database import engine, Base, SessionLocal
+from backend.scripts.seed_sources import initial_sources
+from backend.services.ingestion import fetch_and_process_feeds, shutdown_parse_pool
+
+SLOW_SOURCES = {"Andrej Karpathy", "Stanford HAI"}
+CONDITIONAL_SOURCES = {"OpenAI Blog", "Hugging Face Blog", "Google AI Blog", "AWS Machine Learning"}
+MALFORMED_SOURCES = {"Lil'Log (Lilian Weng)"}
+ATOM_SOURCES = {"Simon Willison"}
+
+def slugify(name):
+    return re.sub(r"[^a-z0-9]+", "-", name.lower()).strip("-")
+
+def rss_item(slug, i, published):
+    return (
+        f"<item><title>{escape(slug)} post {i}: scaling agents with retrieval</title>"
+        f"<link>https://example.com/{slug}/{i}</link><guid>{slug}-{i}</guid>"
+        f"<pubDate>{format_datetime(published)}</pubDate>"
+        f"<description>&lt;p&gt;Entry {i} from {escape(slug)}. We study models, benchmarks and tooling.&lt;/p&gt;</description></item>"
+    )
+
+def atom_entry(slug, i, published):
+    return (
+        f"<entry><id>{slug}-{i}</id><title>{escape(slug)} note {i}</title>"
+        f'<link rel="alternate" href="https://example.com/{slug}/{i}"/>'
+        f"<updated>{published.isoformat()}Z</updated><summary>Notes on LLM tooling, part {i}.</summary></entry>"
+    )
+
+class FeedFixture:
+    def __init__(self, source, fixtures_dir):
+        self.name = source.name
+        self.slug = slugify(source.name)
+        self.is_arxiv = source.name.startswith("arXiv")
+        self.recorded = None
+        if fixtures_dir:
+            path = os.path.join(fixtures_dir, f"{self.slug}.xml")
+            if os.path.exists(path):
+                with open(path, "rb") as f:
+                    self.recorded = f.read()
+
+    def body(self, run):
+        """Return (bytes, entry count) for the given run; plain feeds grow newest-first each run."""
+        if self.recorded is not None:
+            return self.recorded, self.recorded.count(b"<item") + self.recorded.count(b"<entry")
+
+        now = datetime(2025, 6, 1, 12, 0)
+        if self.is_arxiv:
+            # One daily batch, every entry stamped with the same time
+            count = args.arxiv_entries
+            entries = [rss_item(self.slug, i, now) for i in range(count)]
+        else:
+            growing = self.name not in CONDITIONAL_SOURCES
+            count = args.blog_entries + (args.new_per_run * (run - 1) if growing else 0)
+            newest_first = range(count - 1, -1, -1)
+            if self.name in ATOM_SOURCES:
+                entries = [atom_entry(self.slug, i, now + timedelta(hours=i)) for i in newest_first]
+            else:
+                entries = [rss_item(self.slug, i, now + timedelta(hours=i)) for i in newest_first]
+
+        if self.name in ATOM_SOURCES:
+            xml = f'<?xml version="1.0"?><feed xmlns="http://www.w3.org/2005/Atom"><title>{self.slug}</title>{"".join(entries)}</feed>'
+        else:
+            xml = f'<?xml version="1.0"?><rss version="2.0"><channel><title>{self.slug}</title>{"".join(entries)}</channel></rss>'
+        data = xml.encode()
+        if self.name in MALFORMED_SOURCES:
+            data = data[: len(data) // 2] # Truncated mid-document
+        return data, count
+
+class StandIn:
+    """Threaded local HTTP server playing every feed host."""
+
+    def __init__(self, fixtures):
+        self.fixtures = {f.slug: f for f in fixtures}
+        self.run = 1
+        self.entries_served = 0
+        self.lock = threading.Lock()
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                fixture = stand_in.fixtures.get(self.path.strip("/"))
+                if fixture is None:
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                if fixture.name in SLOW_SOURCES:
+                    time.sleep(args.slow_delay)
+
+                data, count = fixture.body(stand_in.run)
+                etag = f'"{fixture.slug}-{len(data)}"'
+                if fixture.name in CONDITIONAL_SOURCES and self.headers.get("If-None-Match") == etag:
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+
+                with stand_in.lock:
+                    stand_in.entries_served += count
+                self.send_response(200)
+                self.send_header("Content-Type", "application/rss+xml; charset=utf-8")
+                self.send_header("Content-Length", str(len(data)))
+                if fixture.name in CONDITIONAL_SOURCES:
+                    self.send_header("ETag", etag)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *_):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.port = self.server.server_address[1]
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def url(self, fixture):
+        return f"http://127.0.0.1:{self.port}/{fixture.slug}"
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 # KB on Linux
+
+async def bench():
+    round_trips = 0
+
+    @event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def count_round_trip(*_):
+        nonlocal round_trips
+        round_trips += 1
+
+    sources = initial_sources()
+    fixtures = [FeedFixture(s, args.fixtures) for s in sources]
+    stand_in = StandIn(fixtures)
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+    async with SessionLocal() as session:
+        for source, fixture in zip(sources, fixtures):
+            source.feed_url = stand_in.url(fixture)
+            session.add(source)
+        await session.commit()
+
+    print(f"{len(sources)} feeds served from 127.0.0.1:{stand_in.port}, DB: {args.db}\n")
+    print(f"{'RUN':<4} | {'SECONDS':>8} | {'FEEDS/S':>8} | {'ENTRIES':>8} | {'ENTRIES/S':>10} | {'NEW ITEMS':>9} | {'DB TRIPS':>8} | {'PEAK RSS MB':>11}")
+    print("-" * 90)
+    for run in range(1, args.runs + 1):
+        stand_in.run = run
+        stand_in.entries_served = 0
+        round_trips = 0
+
+        started = time.perf_counter()
+        new_ids = await fetch_and_process_feeds()
+        elapsed = time.perf_counter() - started
+
+        print(
+            f"{run:<4} | {elapsed:>8.2f} | {len(sources) / elapsed:>8.1f} | {stand_in.entries_served:>8} | "
+            f"{stand_in.entries_served / elapsed:>10.0f} | {len(new_ids):>9} | {round_trips:>8} | {peak_rss_mb():>11.1f}"
+        )
+
+    stand_in.server.shutdown()
+    shutdown_parse_pool()
+    await engine.dispose()
+
+if __name__ == "__main__":
+    asyncio.run(bench())
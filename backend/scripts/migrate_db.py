@@ -0,0 +1,36 @@
+import asyncio
+from sqlalchemy import inspect, text
+from backend.database import engine, Base
+from backend.models import * # Ensure all models are registered
+
+def add_missing_columns(conn):
+    """create_all() never alters existing tables, so add any model columns/indexes the DB is missing."""
+    inspector = inspect(conn)
+    existing_tables = set(inspector.get_table_names())
+
+    for table in Base.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+
+        existing_columns = {c["name"] for c in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing_columns:
+                continue
+            col_type = column.type.compile(dialect=conn.dialect)
+            print(f"Adding column {table.name}.{column.name} ({col_type})")
+            conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {col_type}'))
+
+        existing_indexes = {i["name"] for i in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing_indexes:
+                print(f"Creating index {index.name}")
+                index.create(conn)
+
+async def migrate():
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(add_missing_columns)
+    print("Database schema is up to date.")
+
+if __name__ == "__main__":
+    asyncio.run(migrate())
@@ -0,0 +1,33 @@
+import asyncio
+from sqlalchemy import update
+from sqlalchemy.future import select
+from backend.database import SessionLocal
+from backend.models import Item
+from backend.services.normalize import normalize_content
+
+BATCH_SIZE = 500
+
+async def normalize_items():
+    """Backfill excerpt/body_compressed for items ingested with raw HTML, then drop the raw_text."""
+    total = 0
+    async with SessionLocal() as session:
+        while True:
+            result = await session.execute(
+                select(Item.id, Item.raw_text).where(Item.raw_text != None).limit(BATCH_SIZE)
+            )
+            rows = result.all()
+            if not rows:
+                break
+
+            await session.execute(
+                update(Item),
+                [{"id": item_id, "raw_text": None, **normalize_content(raw_text)} for item_id, raw_text in rows]
+            )
+            await session.commit()
+            total += len(rows)
+            print(f"Normalized {total} items...")
+
+    print(f"Done. Normalized {total} items.")
+
+if __name__ == "__main__":
+    asyncio.run(normalize_items())
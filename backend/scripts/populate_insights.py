@@ -4,6 +4,7 @@ from backend.models import Story, StorySummary, Persona, Item, Source
 from sqlalchemy.future import select
 from sqlalchemy.orm import selectinload
 from backend.services.llm import generate_summary
+from backend.services.prompt_context import build_story_text
 
 async def force_populate():
     async with SessionLocal() as session:
@@ -17,7 +18,7 @@ async def force_populate():
                 "Andrej Karpathy", 
                 "Simon Willison"
             ]))
-            .options(selectinload(Story.items))
+            .options(selectinload(Story.items).undefer(Item.body_compressed), selectinload(Story.items).selectinload(Item.source))
         )
         result = await session.execute(stmt)
         stories = result.scalars().unique().all()
@@ -25,7 +26,7 @@ async def force_populate():
         
         for story in stories:
             print(f"Processing: {story.canonical_title}")
-            story_text = "\n\n".join([f"Title: {i.title}\nText: {i.raw_text}" for i in story.items])
+            story_text = build_story_text(story)
             
             # Force generate for thought_leaders
             data = await generate_summary(story_text, Persona.thought_leaders, "Deep Dives")
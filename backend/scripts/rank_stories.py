@@ -0,0 +1,31 @@
+import asyncio
+from sqlalchemy.future import select
+from backend.database import SessionLocal
+from backend.models import Story
+from backend.services.ranking import update_story_ranks
+
+BATCH_SIZE = 500
+
+async def rank_stories():
+    """Backfill Story.score/item_count/source_count, e.g. for stories clustered before ranking existed."""
+    total = 0
+    last_id = None
+    async with SessionLocal() as session:
+        while True:
+            stmt = select(Story.id).order_by(Story.id).limit(BATCH_SIZE)
+            if last_id is not None:
+                stmt = stmt.where(Story.id > last_id)
+            story_ids = (await session.execute(stmt)).scalars().all()
+            if not story_ids:
+                break
+
+            await update_story_ranks(session, story_ids)
+            await session.commit()
+            last_id = story_ids[-1]
+            total += len(story_ids)
+            print(f"Ranked {total} stories...")
+
+    print(f"Done. Ranked {total} stories.")
+
+if __name__ == "__main__":
+    asyncio.run(rank_stories())
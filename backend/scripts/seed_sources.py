@@ -3,8 +3,8 @@ from backend.database import SessionLocal
 from backend.models import Source, SourceType, TrustLevel
 from sqlalchemy.future import select
 
-async def seed():
-    sources = [
+def initial_sources():
+    return [
         Source(name="arXiv AI", type=SourceType.paper, feed_url="http://export.arxiv.org/rss/cs.AI", trust_level=TrustLevel.high),
         Source(name="arXiv LG", type=SourceType.paper, feed_url="http://export.arxiv.org/rss/cs.LG", trust_level=TrustLevel.high),
         Source(name="arXiv CL", type=SourceType.paper, feed_url="http://export.arxiv.org/rss/cs.CL", trust_level=TrustLevel.high),
@@ -26,6 +26,9 @@ async def seed():
         Source(name="Andrej Karpathy", type=SourceType.blog, feed_url="https://karpathy.ai/feed.xml", trust_level=TrustLevel.high),
         Source(name="Simon Willison", type=SourceType.blog, feed_url="https://simonwillison.net/atom/entries/", trust_level=TrustLevel.high),
     ]
+
+async def seed():
+    sources = initial_sources()
     
     async with SessionLocal() as session:
         for s in sources:
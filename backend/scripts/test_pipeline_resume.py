@@ -0,0 +1,61 @@
+import asyncio
+import os
+import tempfile
+
+# Scratch database: this script crashes pipeline runs on purpose
+DB_PATH = os.path.join(tempfile.mkdtemp(), "pipeline_resume.db")
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{DB_PATH}"
+
+from sqlalchemy import func
+from sqlalchemy.future import select
+from backend import scheduler
+from backend.database import SessionLocal
+from backend.models import PipelineRun, PipelineCheckpoint
+from backend.scripts.migrate_db import migrate
+
+class Crash(BaseException):
+    """Stands in for the process dying mid-run: not an Exception, so the run stays "running"."""
+
+async def no_new_items(source_ids=None, run_id=None):
+    return []
+
+async def test_crash_then_resume():
+    await migrate()
+    scheduler.fetch_and_process_feeds = no_new_items
+
+    async def crashing_summarize(run_id=None):
+        raise Crash()
+    scheduler.summarize_stories = crashing_summarize
+
+    # First run: clusters an empty batch, then dies while summarizing
+    try:
+        await scheduler.run_pipeline()
+        raise AssertionError("first run should have crashed")
+    except Crash:
+        pass
+
+    async with SessionLocal() as db:
+        run = (await db.execute(select(PipelineRun))).scalars().one()
+        assert run.status == "running", run.status
+        crashed_id = run.id
+
+    async def summarize(run_id=None):
+        assert run_id == crashed_id, "run was not resumed"
+    scheduler.summarize_stories = summarize
+
+    # Second run resumes the crashed one and re-checkpoints the same empty cluster batch
+    await scheduler.run_pipeline()
+
+    async with SessionLocal() as db:
+        runs = (await db.execute(select(PipelineRun))).scalars().all()
+        assert [(r.id, r.status) for r in runs] == [(crashed_id, "completed")], runs
+        checkpoints = (await db.execute(
+            select(func.count()).select_from(PipelineCheckpoint)
+            .where(PipelineCheckpoint.run_id == crashed_id, PipelineCheckpoint.stage == "cluster")
+        )).scalar()
+        assert checkpoints == 1, checkpoints
+
+    print("Crash-then-resume OK")
+
+if __name__ == "__main__":
+    asyncio.run(test_crash_then_resume())
@@ -0,0 +1,48 @@
+import math
+from .lsh import normalize_title
+
+# Running bag-of-words centroid per story, built from every member's title and excerpt.
+# Adding a member is O(its terms); matching an item is one sparse dot product.
+TITLE_WEIGHT = 2.0
+EXCERPT_WEIGHT = 1.0
+EXCERPT_WORDS = 60 # Leading excerpt words that count; the rest is mostly boilerplate
+MAX_CENTROID_TERMS = 64 # Persisted centroids keep only their heaviest terms
+
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "has", "have", "how", "in", "into",
+    "is", "it", "its", "new", "of", "on", "or", "our", "that", "the", "their", "this", "to", "we",
+    "what", "why", "with", "you", "your",
+}
+
+def _terms(text):
+    return [t for t in normalize_title(text).split() if len(t) > 1 and t not in STOPWORDS]
+
+def term_vector(title, excerpt=None):
+    vector = {}
+    for term in _terms(title):
+        vector[term] = vector.get(term, 0.0) + TITLE_WEIGHT
+    if excerpt:
+        for term in _terms(excerpt)[:EXCERPT_WORDS]:
+            vector[term] = vector.get(term, 0.0) + EXCERPT_WEIGHT
+    return vector
+
+def add_to_centroid(centroid, vector):
+    """Fold a member's vector into a centroid in place (sum of members; cosine ignores scale)."""
+    for term, weight in vector.items():
+        centroid[term] = centroid.get(term, 0.0) + weight
+    return centroid
+
+def truncate(centroid, limit=MAX_CENTROID_TERMS):
+    if len(centroid) <= limit:
+        return centroid
+    return dict(sorted(centroid.items(), key=lambda kv: (-kv[1], kv[0]))[:limit])
+
+def cosine(a, b):
+    if not a or not b:
+        return 0.0
+    if len(a) > len(b):
+        a, b = b, a
+    dot = sum(weight * b.get(term, 0.0) for term, weight in a.items())
+    if not dot:
+        return 0.0
+    return dot / (math.sqrt(sum(w * w for w in a.values())) * math.sqrt(sum(w * w for w in b.values())))
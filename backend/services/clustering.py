@@ -1,73 +1,380 @@
 import asyncio
+import gc
+import hashlib
+import multiprocessing
+import os
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from array import array
+from contextlib import contextmanager
 from sqlalchemy.future import select
-from sqlalchemy import or_
+from sqlalchemy import or_, update, insert
 from datetime import datetime, timedelta
 from difflib import SequenceMatcher
 from ..database import SessionLocal
-from ..models import Item, Story
+from ..models import Item, Story, StoryIndexEntry
+from . import pipeline
+from .ranking import update_story_ranks
+from .lsh import LSHIndex, title_bands
+from .story_index import load_story_index, merge_bands
+from .centroid import term_vector, add_to_centroid, cosine, truncate
 import logging
-from sqlalchemy.orm import selectinload
 
 logger = logging.getLogger(__name__)
 
-SIMILARITY_THRESHOLD = 0.65  # Adjust based on testing
+SIMILARITY_THRESHOLD = float(os.getenv("SIMILARITY_THRESHOLD", "0.65"))  # Adjust based on testing
+# Cosine similarity has a different scale than SequenceMatcher, so the TF-IDF backend has its own cut-off
+TFIDF_SIMILARITY_THRESHOLD = float(os.getenv("TFIDF_SIMILARITY_THRESHOLD", "0.5"))
+# "sequence": LSH candidates + SequenceMatcher; "tfidf": vectorized TF-IDF cosine (needs numpy/scipy)
+CLUSTERING_BACKEND = os.getenv("CLUSTERING_BACKEND", "sequence")
+# Cosine between an item's terms and a story's centroid at which it counts as a match
+CENTROID_SIMILARITY_THRESHOLD = float(os.getenv("CENTROID_SIMILARITY_THRESHOLD", "0.5"))
+# Runs given new item ids also pick up unclustered items published this recently, so items left
+# behind by a crash between insert and clustering aren't stranded
+UNCLUSTERED_SWEEP_HOURS = float(os.getenv("UNCLUSTERED_SWEEP_HOURS", "48"))
+
+# Worker processes for big batches (backlogs after an outage, a newly added source). 0 = serial.
+# Results are identical to a serial run either way.
+CLUSTER_WORKERS = int(os.getenv("CLUSTER_WORKERS", "0"))
+PARALLEL_MIN_ITEMS = 1000 # Smaller batches aren't worth the pickling
+PARALLEL_SLICE = 100 # Items whose candidate pairs are scored ahead of the serial pass, per round
+
+_cluster_pool = None
+
+def get_cluster_pool():
+    global _cluster_pool
+    if CLUSTER_WORKERS > 0 and _cluster_pool is None:
+        # spawn, not fork: the parent runs an event loop and DB pool we must not copy into workers
+        _cluster_pool = ProcessPoolExecutor(
+            max_workers=CLUSTER_WORKERS, mp_context=multiprocessing.get_context("spawn")
+        )
+    return _cluster_pool
+
+def shutdown_cluster_pool():
+    global _cluster_pool
+    if _cluster_pool is not None:
+        _cluster_pool.shutdown(cancel_futures=True)
+        _cluster_pool = None
 
 def similarity(a, b):
     return SequenceMatcher(None, a, b).ratio()
 
-async def cluster_items():
+def score_pairs(pairs):
+    """Worker: similarity for a shard of (item title, story title) pairs."""
+    return [similarity(a, b) for a, b in pairs]
+
+def prepare_items(rows):
+    """Worker: LSH bands and term vector for a shard of (title, excerpt) rows."""
+    return [(array("q", title_bands(title)), term_vector(title, excerpt)) for title, excerpt in rows]
+
+def shards(seq, count):
+    size = -(-len(seq) // count) # ceil
+    return [seq[i:i + size] for i in range(0, len(seq), size)]
+
+def prefetch_similarities(pool, index, titles, slice_titles, slice_bands):
+    """Score, across the pool, each slice item against the stories its bands hit right now.
+
+    The index only grows during a pass, so every one of these pairs will be asked for; nothing is
+    scored speculatively. Stories created or widened inside the slice are scored inline by the
+    serial pass, which is why slices are short.
+    """
+    pairs = set()
+    for title, bands in zip(slice_titles, slice_bands):
+        pairs.update((title, titles[position]) for position in index.candidates(bands))
+    pairs = sorted(pairs)
+    if not pairs:
+        return {}
+    # A few shards per worker evens out uneven title lengths
+    chunks = shards(pairs, CLUSTER_WORKERS * 4)
+    memo = {}
+    for chunk, ratios in zip(chunks, pool.map(score_pairs, chunks)):
+        memo.update(zip(chunk, ratios))
+    return memo
+
+def plan_sequence(item_titles, story_titles, threshold=None, item_bands=None, story_bands=None,
+                  item_vectors=None, story_centroids=None, pool=None):
+    """Greedy single-pass clustering of item titles against story titles.
+
+    Returns (assignments, scores). assignments[i] is a position in story_titles, or
+    len(story_titles) + k for the k-th new story this batch creates (led by the item that made it).
+    Every planner returns this shape so they can be swapped and compared.
+    Precomputed LSH bands (e.g. from the persisted story index) are used when given. With
+    item_vectors/story_centroids, items are also scored against each story's running centroid.
+    With a process pool, title similarities are scored in parallel a slice ahead of the serial
+    pass, which then only looks them up; assignments are the same as without it.
+    """
+    threshold = SIMILARITY_THRESHOLD if threshold is None else threshold
+    titles = [t.lower() for t in story_titles]
+    if item_bands is None:
+        item_bands = [title_bands(t) for t in item_titles]
+    if story_bands is None:
+        story_bands = [title_bands(t) for t in story_titles]
+    use_centroids = item_vectors is not None
+    if use_centroids:
+        # Copies: centroids grow as items join during the batch
+        centroids = [dict(c) for c in (story_centroids or [{} for _ in story_titles])]
+    else:
+        item_vectors = [None] * len(item_titles)
+
+    # LSH over title shingles narrows each item down to a handful of candidate stories,
+    # so the expensive exact scorer no longer runs against every recent story
+    index = LSHIndex()
+    for position, bands in enumerate(story_bands):
+        index.add(position, bands)
+
+    assignments = []
+    scores = []
+    memo = {}
+    for i, (item_title, bands, vector) in enumerate(zip(item_titles, item_bands, item_vectors)):
+        if pool is not None and i % PARALLEL_SLICE == 0:
+            memo = prefetch_similarities(
+                pool, index, titles,
+                [t.lower() for t in item_titles[i:i + PARALLEL_SLICE]], item_bands[i:i + PARALLEL_SLICE]
+            )
+        best_match = None
+        best_score = 0.0
+        lowered = item_title.lower()
+
+        for position in sorted(index.candidates(bands)):
+            score = memo.get((lowered, titles[position]))
+            if score is None:
+                score = similarity(lowered, titles[position])
+            if use_centroids:
+                # The centroid covers every member, not just the first title; rescale its cosine
+                # onto the title-ratio scale so one threshold decides
+                score = max(score, cosine(vector, centroids[position]) * threshold / CENTROID_SIMILARITY_THRESHOLD)
+            if score > best_score:
+                best_score = score
+                best_match = position
+
+        if best_match is not None and best_score >= threshold:
+            # Members widen the story's buckets, so later variants can find it through them
+            index.add(best_match, bands)
+            if use_centroids:
+                add_to_centroid(centroids[best_match], vector)
+            assignments.append(best_match)
+        else:
+            # New story, visible to later items in this batch
+            index.add(len(titles), bands)
+            if use_centroids:
+                centroids.append(dict(vector))
+            assignments.append(len(titles))
+            titles.append(lowered)
+        scores.append(best_score)
+    return assignments, scores
+
+def plan_tfidf(item_titles, story_titles, threshold=None, item_bands=None, story_bands=None,
+               item_vectors=None, story_centroids=None, pool=None):
+    """plan_sequence's signature, scored by tfidf.plan_tfidf on titles alone.
+
+    Bands aren't needed (the sparse products already skip pairs that share nothing) and scoring
+    is vectorized in this process, so the pool isn't either. Centroids aren't used: on the
+    benchmark corpus they roughly halve this backend's precision, since the TF-IDF cut-off is
+    tuned for title n-grams.
+    """
+    from .tfidf import plan_tfidf as plan
+    ignored = [name for name, value in (("centroids", story_centroids), ("pool", pool)) if value is not None]
+    if ignored:
+        logger.debug(f"TF-IDF planner scores titles in-process; ignoring {', '.join(ignored)}")
+    return plan(item_titles, story_titles, TFIDF_SIMILARITY_THRESHOLD if threshold is None else threshold)
+
+PLANNERS = {
+    "sequence": plan_sequence,
+    "tfidf": plan_tfidf,
+}
+
+def get_planner(name=None):
+    name = name or CLUSTERING_BACKEND
+    if name not in PLANNERS:
+        raise ValueError(f"Unknown clustering backend '{name}', expected one of {sorted(PLANNERS)}")
+    return PLANNERS[name]
+
+class ClusterItem:
+    """Just the columns clustering reads. No ORM identity map, instance state or relationships."""
+    __slots__ = ("id", "title", "excerpt")
+
+    def __init__(self, id, title, excerpt):
+        self.id = id
+        self.title = title or ""
+        self.excerpt = excerpt
+
+@contextmanager
+def gc_frozen():
+    # The working set (bands, term vectors, story rows) is lots of small long-lived containers the
+    # cyclic GC would keep rescanning for nothing. gc.freeze() parks everything alive now outside
+    # the collector's generations instead of turning collection off, which would hit the whole
+    # process: planning runs in a thread next to the API's event loop and the scheduler.
+    gc.freeze()
+    try:
+        yield
+    finally:
+        gc.unfreeze()
+
+async def load_unclustered_items(session, item_ids=None):
+    """Unclustered items in arrival order; greedy clustering depends on the order it sees them in.
+
+    With item_ids, those items plus any unclustered ones published in the last UNCLUSTERED_SWEEP_HOURS.
+    """
+    columns = select(Item.id, Item.title, Item.excerpt)
+    if item_ids is None:
+        result = await session.execute(
+            columns.where(Item.story_id == None).order_by(Item.published_at, Item.id)
+        )
+        return [ClusterItem(*row) for row in result.all()]
+
+    # The given items (e.g. the ones ingestion just inserted), chunked to bound the IN list
+    items = {}
+    item_ids = list(item_ids)
+    for i in range(0, len(item_ids), 500):
+        result = await session.execute(
+            columns.where(Item.id.in_(item_ids[i:i + 500]), Item.story_id == None)
+        )
+        items.update((row.id, ClusterItem(*row)) for row in result.all())
+
+    # Plus recent leftovers from earlier runs; they arrived first, so they go first
+    since = datetime.utcnow() - timedelta(hours=UNCLUSTERED_SWEEP_HOURS)
+    result = await session.execute(
+        columns.where(Item.story_id == None, Item.published_at >= since).order_by(Item.published_at, Item.id)
+    )
+    given = set(item_ids)
+    leftovers = [ClusterItem(*row) for row in result.all() if row.id not in given]
+    if leftovers:
+        logger.info(f"Also clustering {len(leftovers)} unclustered items left from earlier runs")
+    # IN queries come back in index order, not in the order the caller gave
+    return leftovers + [items[item_id] for item_id in item_ids if item_id in items]
+
+def plan_batch(items, story_titles, story_bands, story_centroids):
+    """Bands, term vectors and the planner's (assignments, scores) for a batch of ClusterItems."""
+    planner = get_planner()
+    pool = get_cluster_pool() if len(items) >= PARALLEL_MIN_ITEMS else None
+    rows = [(item.title, item.excerpt) for item in items]
+    if pool is not None:
+        prepared = [p for shard in pool.map(prepare_items, shards(rows, CLUSTER_WORKERS * 4)) for p in shard]
+    else:
+        prepared = prepare_items(rows)
+    # 64-bit band keys packed in arrays: a quarter of the memory of lists of ints
+    item_bands = [bands for bands, _ in prepared]
+    item_vectors = [vector for _, vector in prepared]
+    del prepared, rows
+    with gc_frozen():
+        assignments, scores = planner(
+            [item.title for item in items],
+            story_titles,
+            item_bands=item_bands,
+            story_bands=story_bands,
+            item_vectors=item_vectors,
+            story_centroids=story_centroids,
+            pool=pool
+        )
+    return item_bands, item_vectors, assignments, scores
+
+async def cluster_items(item_ids=None, run_id=None):
+    """Cluster unclustered items into stories. If item_ids is given, only those items are considered.
+
+    With a pipeline run_id, the batch is checkpointed under a key of its item set. It is never
+    skipped on resume: only items without a story are loaded, so a resumed run redoes nothing the
+    crashed one committed and still clusters items from sources that run never got to.
+    """
     async with SessionLocal() as session:
+        if run_id:
+            await pipeline.start_stage(session, run_id, "cluster", 1)
+
         # Get unclustered items
-        result = await session.execute(select(Item).where(Item.story_id == None))
-        unclustered_items = result.scalars().all()
+        unclustered_items = await load_unclustered_items(session, item_ids)
+        batch_key = hashlib.sha256(",".join(sorted(str(i.id) for i in unclustered_items)).encode()).hexdigest()
         
         if not unclustered_items:
             logger.info("No unclustered items found.")
+            if run_id:
+                await pipeline.mark_done(session, run_id, "cluster", batch_key)
+                await session.commit()
             return
 
-        # Get recent stories (last 72 hours)
-        three_days_ago = datetime.utcnow() - timedelta(hours=72)
-        result = await session.execute(
-            select(Story).where(Story.created_at >= three_days_ago).options(selectinload(Story.items))
+        # Recent stories come from the compact persisted index, not the Story/Item graph
+        index_rows = await load_story_index(session)
+        story_ids = [row.story_id for row in index_rows]
+        story_titles = [row.canonical_title or "" for row in index_rows]
+        story_bands = [row.bands or [] for row in index_rows]
+        # Rows indexed before centroids existed start from their canonical title
+        story_centroids = [row.centroid or term_vector(title) for row, title in zip(index_rows, story_titles)]
+
+        # CPU-bound; off the event loop so the API stays responsive meanwhile
+        item_bands, item_vectors, assignments, scores = await asyncio.to_thread(
+            plan_batch, unclustered_items, story_titles, story_bands, story_centroids
         )
-        recent_stories = result.scalars().all()
         
-        created_stories = 0
+        # Everything is decided in memory with client-side story ids, then written in a few
+        # bulk statements: no flush round trip per new story
+        new_stories = []
+        new_entries = {}
+        touched = {}
+        item_updates = []
         updated_stories = 0
+        now = datetime.utcnow()
         
-        for item in unclustered_items:
-            best_match = None
-            best_score = 0.0
-            
-            # Simple title comparison against story canonical titles
-            # (In production, comparing against all items in story is better, but this is MVP)
-            for story in recent_stories:
-                score = similarity(item.title.lower(), story.canonical_title.lower())
-                if score > best_score:
-                    best_score = score
-                    best_match = story
-            
-            if best_match and best_score >= SIMILARITY_THRESHOLD:
+        for item, bands, vector, position, score in zip(unclustered_items, item_bands, item_vectors, assignments, scores):
+            if position < len(story_ids):
                 # Add to existing story
-                item.story_id = best_match.id
+                story_id = story_ids[position]
+                if position not in touched:
+                    touched[position] = {"bands": story_bands[position], "centroid": dict(story_centroids[position])}
+                entry = touched[position]
+                entry["bands"] = merge_bands(entry["bands"], bands)
+                add_to_centroid(entry["centroid"], vector)
                 updated_stories += 1
-                logger.info(f"Matched '{item.title}' to story '{best_match.canonical_title}' (Score: {best_score:.2f})")
+                logger.info(f"Matched '{item.title}' to story '{story_titles[position]}' (Score: {score:.2f})")
+            elif position in new_entries:
+                # Joined a story created earlier in this batch
+                entry = new_entries[position]
+                story_id = entry["story_id"]
+                entry["bands"] = merge_bands(entry["bands"], bands)
+                add_to_centroid(entry["centroid"], vector)
+                updated_stories += 1
+                logger.info(f"Matched '{item.title}' to story '{entry['canonical_title']}' (Score: {score:.2f})")
             else:
                 # Create new story
-                new_story = Story(
-                    canonical_title=item.title,
-                    score=0.0, # Initial score
-                    tags=[]
-                )
-                session.add(new_story)
-                await session.flush() # Get ID
-                
-                item.story_id = new_story.id
-                # Add to local list for subsequent matches in this loop
-                recent_stories.append(new_story)
-                created_stories += 1
+                story_id = uuid.uuid4()
+                new_stories.append({
+                    "id": story_id,
+                    "canonical_title": item.title,
+                    "created_at": now,
+                    "score": 0.0, # Set by update_story_ranks below
+                    "tags": []
+                })
+                new_entries[position] = {
+                    "story_id": story_id,
+                    "canonical_title": item.title,
+                    "bands": list(bands),
+                    "centroid": dict(vector),
+                    "created_at": now,
+                    "updated_at": now,
+                    "dirty": True
+                }
                 logger.info(f"Created new story for '{item.title}'")
+            item_updates.append({"id": item.id, "story_id": story_id})
+
+        if new_stories:
+            await session.execute(insert(Story), new_stories)
+            for entry in new_entries.values():
+                entry["centroid"] = truncate(entry["centroid"])
+            await session.execute(insert(StoryIndexEntry), list(new_entries.values()))
+        # Keep the index current: grown bands/centroids for the stories items joined
+        if touched:
+            await session.execute(
+                update(StoryIndexEntry),
+                [
+                    {"story_id": story_ids[p], "bands": t["bands"], "centroid": truncate(t["centroid"]), "updated_at": now, "dirty": True}
+                    for p, t in touched.items()
+                ]
+            )
+        # One executemany UPDATE items SET story_id=... WHERE id=... for the whole batch
+        await session.execute(update(Item), item_updates)
+        # Rank only the stories this batch touched
+        await update_story_ranks(session, {u["story_id"] for u in item_updates})
+        created_stories = len(new_stories)
         
+        if run_id:
+            await pipeline.mark_done(session, run_id, "cluster", batch_key)
         await session.commit()
         logger.info(f"Clustering complete. Created {created_stories} stories, updated {updated_stories}.")
 
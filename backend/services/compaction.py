@@ -0,0 +1,281 @@
+import asyncio
+import heapq
+import os
+import math
+import logging
+from collections import defaultdict
+from sqlalchemy import delete, update, and_, or_
+from sqlalchemy.orm import aliased
+from sqlalchemy.future import select
+from ..database import SessionLocal
+from ..models import Item, Story, StorySummary, UserSave, StoryIndexEntry
+from .lsh import LSHIndex
+from .story_index import window_start, merge_bands
+from .centroid import term_vector, add_to_centroid, cosine, truncate
+from .ranking import update_story_ranks
+from .feed_parsing import to_naive_utc
+
+logger = logging.getLogger(__name__)
+
+# Greedy clustering depends on item order, so the same story can end up split across several
+# stories. Compaction merges recent stories whose centroids have converged and flags stories
+# whose members drifted apart. It only looks at stories touched since the last compaction.
+MERGE_SIMILARITY_THRESHOLD = float(os.getenv("MERGE_SIMILARITY_THRESHOLD", "0.5"))
+# A term in at most this share of the window's stories is distinctive (a name, not a template word)
+ANCHOR_MAX_SHARE = 0.01
+DOMINANT_TERMS = 12
+# Flag a story for a split once this share of its members share no distinctive term with the rest
+SPLIT_OUTLIER_SHARE = 0.3
+MIN_SPLIT_MEMBERS = 3
+
+class WindowState:
+    """In-process copy of the window's story bands and centroids, with term document frequencies.
+
+    Built from the index once per process, then kept current from the rows clustering marked
+    dirty, so a pass costs what changed since the last one rather than the size of the window.
+    """
+
+    def __init__(self):
+        self.entries = {} # story_id -> (created_at, bands, centroid)
+        self.expiry = [] # (created_at, story_id) heap
+        self.index = LSHIndex()
+        self.df = defaultdict(int)
+        self.drifted = set()
+
+    def put(self, story_id, created_at, bands, centroid):
+        self.remove(story_id)
+        bands, centroid = list(bands or []), dict(centroid or {})
+        self.entries[story_id] = (created_at, bands, centroid)
+        heapq.heappush(self.expiry, (to_naive_utc(created_at), str(story_id), story_id))
+        self.index.add(story_id, bands)
+        for term in centroid:
+            self.df[term] += 1
+
+    def remove(self, story_id):
+        old = self.entries.pop(story_id, None)
+        if old is None:
+            return
+        self.index.remove(story_id, old[1])
+        for term in old[2]:
+            self.df[term] -= 1
+            if not self.df[term]:
+                del self.df[term]
+        self.drifted.discard(story_id)
+
+    def evict(self, since):
+        while self.expiry and self.expiry[0][0] < since:
+            created_at, _, story_id = heapq.heappop(self.expiry)
+            entry = self.entries.get(story_id)
+            if entry is not None and to_naive_utc(entry[0]) == created_at:
+                self.remove(story_id)
+
+    def idf(self, term):
+        """Inverse document frequency of a term across the window's centroids; 0 if none has it.
+
+        Headline templates ("raises", "launches", "series") are shared by unrelated stories; names
+        are not. Weighting by IDF makes converging centroids mean the same entities, not the same template.
+        """
+        count = self.df.get(term, 0)
+        if not count:
+            return 0.0
+        return math.log((1 + len(self.entries)) / (1 + count)) + 1.0
+
+_state = None
+
+async def window_state(session):
+    global _state
+    since = window_start()
+    if _state is None:
+        state = WindowState()
+        result = await session.execute(
+            select(StoryIndexEntry.story_id, StoryIndexEntry.created_at, StoryIndexEntry.bands, StoryIndexEntry.centroid)
+            .where(StoryIndexEntry.created_at >= since)
+        )
+        for row in result.all():
+            state.put(*row)
+        result = await session.execute(select(Story.id).where(Story.needs_split == True, Story.created_at >= since))
+        state.drifted.update(story_id for story_id in result.scalars().all() if story_id in state.entries)
+        _state = state
+    _state.evict(since)
+    return _state
+
+def reset_window_state():
+    """Drop the in-process state; the next pass rebuilds it from the index (e.g. after a failed pass)."""
+    global _state
+    _state = None
+
+def anchor_weight(n):
+    """IDF of a term found in ANCHOR_MAX_SHARE of n stories (at least 2: the pair being compared)."""
+    return math.log((1 + n) / (1 + max(2, ANCHOR_MAX_SHARE * n))) + 1.0
+
+def shares_anchor(a, b, idf, anchor_idf):
+    if len(a) > len(b):
+        a, b = b, a
+    return any(idf(term) >= anchor_idf for term in a if term in b)
+
+def weighted(centroid, idf):
+    """IDF-weighted centroid, cut to its dominant terms: what the story is mostly about."""
+    return truncate({term: weight * idf(term) for term, weight in centroid.items()}, DOMINANT_TERMS)
+
+async def merge_story(session, keep, drop):
+    """Fold story `drop` into `keep`: items, saves and summaries move over, then drop is deleted."""
+    await session.execute(update(Item).where(Item.story_id == drop.story_id).values(story_id=keep.story_id))
+
+    # A user who saved both keeps the one save
+    await session.execute(
+        delete(UserSave).where(
+            UserSave.story_id == drop.story_id,
+            UserSave.user_id.in_(select(UserSave.user_id).where(UserSave.story_id == keep.story_id))
+        )
+    )
+    await session.execute(update(UserSave).where(UserSave.story_id == drop.story_id).values(story_id=keep.story_id))
+
+    # Summaries for a persona/category the survivor already covers are duplicates
+    kept = aliased(StorySummary)
+    duplicate = (
+        select(kept.id)
+        .where(
+            kept.story_id == keep.story_id,
+            kept.persona == StorySummary.persona,
+            kept.category.is_not_distinct_from(StorySummary.category)
+        )
+        .exists()
+    )
+    await session.execute(
+        delete(StorySummary)
+        .where(and_(StorySummary.story_id == drop.story_id, duplicate))
+        .execution_options(synchronize_session=False)
+    )
+    await session.execute(update(StorySummary).where(StorySummary.story_id == drop.story_id).values(story_id=keep.story_id))
+
+    keep.bands = merge_bands(keep.bands or [], drop.bands or [])
+    keep.centroid = truncate(add_to_centroid(dict(keep.centroid or {}), drop.centroid or {}))
+    await session.delete(drop)
+    # The session doesn't autoflush: the index row has to go before the story it references
+    await session.flush()
+    await session.execute(delete(Story).where(Story.id == drop.story_id))
+
+async def flag_drifted(session, story_ids, idf, anchor_idf):
+    """Set Story.needs_split where too many members share no distinctive term with the rest.
+
+    Members of one story keep naming the same company, product or paper; a story that absorbed
+    neighbouring ones only agrees on template and topic words. Returns the flagged story ids.
+    """
+    members = defaultdict(list)
+    story_ids = list(story_ids)
+    for i in range(0, len(story_ids), 500):
+        result = await session.execute(
+            select(Item.story_id, Item.title, Item.excerpt).where(Item.story_id.in_(story_ids[i:i + 500]))
+        )
+        for story_id, title, excerpt in result.all():
+            members[story_id].append(term_vector(title or "", excerpt))
+
+    flags = []
+    drifted = set()
+    for story_id in story_ids:
+        vectors = members.get(story_id, [])
+        if len(vectors) >= MIN_SPLIT_MEMBERS:
+            # How many members mention each distinctive term
+            counts = defaultdict(int)
+            for vector in vectors:
+                for term in vector:
+                    if idf(term) >= anchor_idf:
+                        counts[term] += 1
+            outliers = sum(1 for vector in vectors if not any(counts.get(term, 0) > 1 for term in vector))
+            if outliers >= SPLIT_OUTLIER_SHARE * len(vectors):
+                drifted.add(story_id)
+        flags.append({"id": story_id, "needs_split": story_id in drifted})
+    if flags:
+        await session.execute(update(Story), flags)
+    return drifted
+
+async def compact_stories():
+    """Merge converged stories and flag drifted ones, among stories touched since the last run."""
+    async with SessionLocal() as session:
+        try:
+            await compact(session)
+        except Exception:
+            # Merges applied to the in-process state were rolled back in the database
+            reset_window_state()
+            raise
+
+async def compact(session):
+    state = await window_state(session)
+    result = await session.execute(
+        select(StoryIndexEntry)
+        # NULL: rows indexed before compaction existed
+        .where(StoryIndexEntry.created_at >= window_start(), or_(StoryIndexEntry.dirty == True, StoryIndexEntry.dirty == None))
+        .order_by(StoryIndexEntry.created_at, StoryIndexEntry.story_id)
+    )
+    dirty = list(result.scalars().all())
+    if not dirty:
+        logger.info("Compaction: no stories touched since the last run.")
+        return
+
+    # Clustering grew these since the state last saw them (or created them)
+    for entry in dirty:
+        state.put(entry.story_id, entry.created_at, entry.bands, entry.centroid)
+    anchor_idf = anchor_weight(len(state.entries))
+    vectors = {}
+
+    def vector(story_id):
+        # Only for the stories this pass looks at; the window's other stories are never weighted
+        if story_id not in vectors:
+            vectors[story_id] = weighted(state.entries[story_id][2], state.idf)
+        return vectors[story_id]
+
+    # Drifted stories are left for a split; merging them would only spread the mix
+    dirty_ids = [e.story_id for e in dirty]
+    drifted = await flag_drifted(session, dirty_ids, state.idf, anchor_idf)
+    state.drifted.difference_update(dirty_ids)
+    state.drifted.update(drifted)
+
+    merged = 0
+    grown = set()
+    merged_away = set()
+    for entry in dirty:
+        if entry.story_id in merged_away or entry.story_id in state.drifted:
+            continue # Merged away earlier in this pass, or waiting for a split
+
+        best_id, best_score = None, 0.0
+        for candidate_id in sorted(state.index.candidates(entry.bands or []), key=str):
+            if candidate_id == entry.story_id or candidate_id in state.drifted:
+                continue
+            if not shares_anchor(vector(entry.story_id), vector(candidate_id), state.idf, anchor_idf):
+                continue
+            score = cosine(vector(entry.story_id), vector(candidate_id))
+            if score > best_score:
+                best_id, best_score = candidate_id, score
+        if best_id is None or best_score < MERGE_SIMILARITY_THRESHOLD:
+            continue
+
+        best = await session.get(StoryIndexEntry, best_id)
+        if best is None:
+            state.remove(best_id) # Gone from the index since the state was built
+            continue
+
+        # The older story survives, so its id (and saved links to it) stay stable
+        keep, drop = sorted((entry, best), key=lambda e: (to_naive_utc(e.created_at), str(e.story_id)))
+        logger.info(f"Merging story '{drop.canonical_title}' into '{keep.canonical_title}' (Score: {best_score:.2f})")
+        await merge_story(session, keep, drop)
+        state.remove(drop.story_id)
+        state.put(keep.story_id, keep.created_at, keep.bands, keep.centroid)
+        vectors.pop(keep.story_id, None)
+        merged_away.add(drop.story_id)
+        grown.discard(drop.story_id)
+        grown.add(keep.story_id)
+        merged += 1
+
+    await update_story_ranks(session, grown)
+
+    # Survivors are looked at again only once clustering touches them; re-checking grown
+    # centroids straight away chains merges
+    for entry in dirty:
+        if entry.story_id not in merged_away:
+            entry.dirty = False
+    await session.commit()
+    logger.info(f"Compaction complete. Checked {len(dirty)} stories, merged {merged}, {len(state.drifted)} stories flagged for a split.")
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(compact_stories())
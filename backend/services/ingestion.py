@@ -1,88 +1,289 @@
-import feedparser
 import asyncio
 import ssl
+import os
+import httpx
+import multiprocessing
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from urllib.parse import urlparse
 
 if hasattr(ssl, '_create_unverified_context'):
     ssl._create_default_https_context = ssl._create_unverified_context
 from sqlalchemy.future import select
 from sqlalchemy.orm import selectinload
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from datetime import datetime
 import hashlib
+import uuid
 from ..database import SessionLocal
 from ..models import Source, Item, SourceType
+from .feed_parsing import parse_entries, to_naive_utc
+from .polling import record_poll
+from .normalize import normalize_contents
+from . import pipeline
 import logging
 
 logger = logging.getLogger(__name__)
 
-def parse_feed(url):
-    return feedparser.parse(url, agent="Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.114 Safari/537.36")
+USER_AGENT = "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.114 Safari/537.36"
+
+# Fetch tuning: total in-flight downloads, in-flight downloads per host
+# (arXiv serves 4+ feeds from one host) and a hard per-feed deadline in seconds.
+FETCH_CONCURRENCY = int(os.getenv("FETCH_CONCURRENCY", "16"))
+FETCH_PER_HOST_LIMIT = int(os.getenv("FETCH_PER_HOST_LIMIT", "2"))
+FETCH_TIMEOUT = float(os.getenv("FETCH_TIMEOUT", "30"))
+
+# Parse feeds in this many worker processes instead of the default thread pool, keeping
+# feedparser's CPU work off the API's event loop/GIL. 0 = thread pool.
+PARSE_WORKERS = int(os.getenv("PARSE_WORKERS", "0"))
+
+# Max hashes per IN (...) lookup; keeps us under SQLite's bound-parameter limit
+DEDUPE_CHUNK_SIZE = 500
+# Bound parameters per multi-row INSERT: older SQLite builds allow 999 (asyncpg allows 32767)
+INSERT_MAX_PARAMS = 999
+
+_parse_pool = None
+
+def get_parse_executor():
+    """The process pool for parsing, created on first use; None means the default thread pool."""
+    global _parse_pool
+    if PARSE_WORKERS > 0 and _parse_pool is None:
+        # spawn, not fork: the parent runs an event loop and DB pool we must not copy into workers
+        _parse_pool = ProcessPoolExecutor(
+            max_workers=PARSE_WORKERS, mp_context=multiprocessing.get_context("spawn")
+        )
+    return _parse_pool
+
+def shutdown_parse_pool():
+    global _parse_pool
+    if _parse_pool is not None:
+        _parse_pool.shutdown(cancel_futures=True)
+        _parse_pool = None
 
 def generate_hash(title, url):
     return hashlib.md5(f"{title}{url}".encode()).hexdigest()
 
-async def fetch_and_process_feeds():
+def create_http_client():
+    # One pooled client per run so connections (and TLS sessions) to the same host are reused.
+    # verify=False mirrors the unverified SSL context feedparser used before.
+    return httpx.AsyncClient(
+        headers={"User-Agent": USER_AGENT},
+        follow_redirects=True,
+        verify=False,
+        timeout=httpx.Timeout(FETCH_TIMEOUT),
+        limits=httpx.Limits(max_connections=FETCH_CONCURRENCY, max_keepalive_connections=FETCH_CONCURRENCY),
+    )
+
+def conditional_headers(source):
+    headers = {}
+    if source.etag:
+        headers["If-None-Match"] = source.etag
+    if source.last_modified:
+        headers["If-Modified-Since"] = source.last_modified
+    return headers
+
+def update_validators(source, response, content_hash):
+    source.etag = response.headers.get("etag")
+    source.last_modified = response.headers.get("last-modified")
+    source.content_hash = content_hash
+
+async def fetch_feed(client, source, global_limit, host_limits):
+    host = urlparse(source.feed_url).netloc
+    # Per-host slot first: a download waiting on its host must not hold one of the global slots
+    async with host_limits[host], global_limit:
+        response = await asyncio.wait_for(
+            client.get(source.feed_url, headers=conditional_headers(source)),
+            timeout=FETCH_TIMEOUT
+        )
+    if response.status_code != 304:
+        response.raise_for_status()
+    return response
+
+async def fetch_all(sources):
+    """Download every feed concurrently, yielding (source, response, error) as each one finishes."""
+    global_limit = asyncio.Semaphore(FETCH_CONCURRENCY)
+    host_limits = defaultdict(lambda: asyncio.Semaphore(FETCH_PER_HOST_LIMIT))
+
+    async with create_http_client() as client:
+        async def run(source):
+            try:
+                return source, await fetch_feed(client, source, global_limit, host_limits), None
+            except Exception as e:
+                return source, None, e
+
+        tasks = [asyncio.create_task(run(source)) for source in sources]
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+
+async def find_existing_hashes(session, hashes):
+    """Resolve which hashes are already stored with one set-based query per chunk."""
+    existing = set()
+    hashes = list(hashes)
+    for i in range(0, len(hashes), DEDUPE_CHUNK_SIZE):
+        chunk = hashes[i:i + DEDUPE_CHUNK_SIZE]
+        result = await session.execute(select(Item.hash).where(Item.hash.in_(chunk)))
+        existing.update(result.scalars().all())
+    return existing
+
+async def insert_items(session, rows):
+    """Multi-row insert that silently drops rows whose hash already exists.
+
+    Returns the ids that were actually inserted, so a concurrent run (e.g. the manual
+    /run-pipeline trigger overlapping the scheduler) can't produce duplicates or errors.
+    """
+    if not rows:
+        return []
+    insert = pg_insert if session.get_bind().dialect.name == "postgresql" else sqlite_insert
+    # One parameter per column per row, so a big feed is split into several statements
+    chunk_size = max(1, INSERT_MAX_PARAMS // len(rows[0]))
+    inserted = []
+    for i in range(0, len(rows), chunk_size):
+        stmt = (
+            insert(Item)
+            .values(rows[i:i + chunk_size])
+            .on_conflict_do_nothing(index_elements=["hash"])
+            .returning(Item.id)
+        )
+        result = await session.execute(stmt)
+        inserted.extend(result.scalars().all())
+    return inserted
+
+def update_watermark(source, entries):
+    # Entries are newest-first; the GUID mark goes on the newest dated one, since an undated
+    # entry can't tell the next run where new content stops
+    newest = next((e for e in entries if e.published), entries[0])
+    source.last_seen_guid = newest.guid
+    latest = max((e.published for e in entries if e.published), default=None)
+    if latest and (source.last_seen_published_at is None or latest > to_naive_utc(source.last_seen_published_at)):
+        source.last_seen_published_at = latest
+
+async def process_feed(session, source, entries, seen_hashes, parse_executor=None):
+    # Hash every entry first so dedupe is a single lookup for the whole feed
+    candidates = {}
+    for entry in entries:
+        item_hash = generate_hash(entry.title, entry.link)
+        if item_hash not in seen_hashes and item_hash not in candidates:
+            candidates[item_hash] = entry
+
+    existing = await find_existing_hashes(session, candidates.keys())
+    seen_hashes.update(candidates.keys())
+
+    new_entries = [(h, e) for h, e in candidates.items() if h not in existing]
+    # HTML stripping + compression is CPU work: same executor as parsing, so with PARSE_WORKERS
+    # it runs in the worker processes, not under the API's GIL. Only new entries get here.
+    normalized = await asyncio.get_running_loop().run_in_executor(
+        parse_executor, normalize_contents, [e.content for _, e in new_entries]
+    )
+
+    rows = []
+    for (item_hash, entry), content in zip(new_entries, normalized):
+        rows.append({
+            "id": uuid.uuid4(),
+            "source_id": source.id,
+            "title": entry.title,
+            "url": entry.link,
+            "published_at": entry.published or datetime.utcnow(),
+            **content,
+            "content_type": source.type,
+            "hash": item_hash,
+            "metadata_json": {"author": entry.author},
+        })
+
+    inserted_ids = await insert_items(session, rows)
+    if entries:
+        update_watermark(source, entries)
+    return inserted_ids
+
+async def finish_source(session, source, run_id, failed=False, new_items=0):
+    """Schedule the source's next poll and checkpoint it, in the same commit as its items."""
+    await record_poll(session, source, failed=failed, new_items=new_items)
+    if run_id:
+        await pipeline.mark_done(session, run_id, "ingest", source.id)
+    await session.commit()
+
+async def fetch_and_process_feeds(source_ids=None, run_id=None):
+    """Ingest feeds (all of them, or just source_ids) and return the ids of newly inserted items.
+
+    With a pipeline run_id, sources already checkpointed by that run are skipped.
+    """
+    inserted_ids = []
     async with SessionLocal() as session:
-        result = await session.execute(select(Source))
-        sources = result.scalars().all()
-        
-        for source in sources:
-            if not source.feed_url:
+        stmt = select(Source)
+        if source_ids is not None:
+            stmt = stmt.where(Source.id.in_(source_ids))
+        result = await session.execute(stmt)
+        sources = [s for s in result.scalars().all() if s.feed_url]
+
+        if run_id:
+            done = await pipeline.completed_units(session, run_id, "ingest")
+            await pipeline.start_stage(session, run_id, "ingest", len(sources))
+            await session.commit()
+            sources = [s for s in sources if str(s.id) not in done]
+
+        logger.info(f"Fetching {len(sources)} feeds (concurrency={FETCH_CONCURRENCY}, per host={FETCH_PER_HOST_LIMIT})")
+        loop = asyncio.get_running_loop()
+        parse_executor = get_parse_executor()
+        # Hashes already resolved this run, so entries syndicated by several feeds are checked once
+        seen_hashes = set()
+
+        # Downloads overlap; parsing and DB writes happen one feed at a time as downloads land,
+        # since a single AsyncSession must not be used concurrently.
+        async for source, response, error in fetch_all(sources):
+            if error is not None:
+                logger.error(f"Error fetching {source.name}: {error!r}")
+                await finish_source(session, source, run_id, failed=True)
                 continue
-                
-            logger.info(f"Fetching {source.name} from {source.feed_url}")
-            
-            # Run blocking feedparser in executor
-            loop = asyncio.get_event_loop()
+
+            if response.status_code == 304:
+                logger.info(f"{source.name} not modified (304), skipping")
+                await finish_source(session, source, run_id)
+                continue
+
+            # Servers without validator support still often return identical bytes
+            content_hash = hashlib.sha256(response.content).hexdigest()
+            if content_hash == source.content_hash:
+                logger.info(f"{source.name} body unchanged, skipping")
+                update_validators(source, response, content_hash)
+                await finish_source(session, source, run_id)
+                continue
+
+            watermark = (to_naive_utc(source.last_seen_published_at), source.last_seen_guid)
             try:
-                feed = await loop.run_in_executor(None, parse_feed, source.feed_url)
+                # Workers hand back only (bozo message, FeedEntry tuples), never FeedParserDicts
+                bozo_exception, entries = await loop.run_in_executor(
+                    parse_executor, parse_entries, response.content, dict(response.headers), watermark
+                )
             except Exception as e:
-                logger.error(f"Error fetching {source.name}: {e}")
+                logger.error(f"Error parsing {source.name}: {e}")
+                if isinstance(e, BrokenProcessPool):
+                    # A worker died (e.g. OOM on a huge feed); start a fresh pool for the next feed
+                    shutdown_parse_pool()
+                    parse_executor = get_parse_executor()
+                await finish_source(session, source, run_id, failed=True)
                 continue
             
-            if feed.bozo:
-                logger.warning(f"Feed {source.name} bozo exception: {feed.bozo_exception}")
-
-            logger.info(f"Found {len(feed.entries)} entries for {source.name}")
-                
-            new_items_count = 0
-            for entry in feed.entries:
-                title = entry.get('title', '')
-                link = entry.get('link', '')
-                published = entry.get('published_parsed') or entry.get('updated_parsed')
-                if published:
-                    published_dt = datetime(*published[:6])
-                else:
-                    published_dt = datetime.utcnow()
-                    
-                item_hash = generate_hash(title, link)
-                
-                # Check dedupe
-                existing = await session.execute(select(Item).where(Item.hash == item_hash))
-                if existing.scalars().first():
-                    continue
-                
-                # Normalize content
-                content = ""
-                if 'summary' in entry:
-                    content = entry.summary
-                elif 'content' in entry:
-                    content = entry.content[0].value
-                
-                new_item = Item(
-                    source_id=source.id,
-                    title=title,
-                    url=link,
-                    published_at=published_dt,
-                    raw_text=content,
-                    content_type=source.type,
-                    hash=item_hash,
-                    metadata_json={"author": entry.get('author', '')}
-                )
-                session.add(new_item)
-                new_items_count += 1
-            
-            await session.commit()
-            logger.info(f"Ingested {new_items_count} items from {source.name}")
+            if bozo_exception:
+                logger.warning(f"Feed {source.name} bozo exception: {bozo_exception}")
+
+            logger.info(f"Found {len(entries)} entries newer than the watermark for {source.name}")
+            try:
+                new_ids = await process_feed(session, source, entries, seen_hashes, parse_executor)
+            except BrokenProcessPool as e:
+                # Died normalizing; nothing was written and the validators are untouched, so it refetches
+                logger.error(f"Error normalizing {source.name}: {e}")
+                shutdown_parse_pool()
+                parse_executor = get_parse_executor()
+                await finish_source(session, source, run_id, failed=True)
+                continue
+            # Committed together with the feed's items, so a failed run refetches next time
+            update_validators(source, response, content_hash)
+            await finish_source(session, source, run_id, failed=bozo_exception is not None, new_items=len(new_ids))
+            inserted_ids.extend(new_ids)
+            logger.info(f"Ingested {len(new_ids)} items from {source.name}")
+
+    return inserted_ids
 
 if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO)
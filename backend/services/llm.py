@@ -9,7 +9,10 @@ import logging
 from sqlalchemy.future import select
 from sqlalchemy.orm import selectinload
 from ..database import SessionLocal
-from ..models import Story, StorySummary, Persona, SourceType
+from ..models import Story, StorySummary, Persona, SourceType, Item
+from . import pipeline, llm_cache
+from .rate_limit import generate_content, LLM_CONCURRENCY
+from .prompt_context import build_story_text, item_set_key
 
 logger = logging.getLogger(__name__)
 
@@ -25,109 +28,124 @@ HIERARCHY = {
     "thought_leaders": ["Deep Dives", "Concepts", "Hot Takes"]
 }
 
-async def generate_summary(story_text, persona: Persona, category: str):
-    if not api_key:
-        logger.warning("GEMINI_API_KEY not set. Skipping summarization.")
-        return None
+MODEL_NAME = "gemini-2.5-flash"
+# "combined": one structured-output call per story returns the classification and every summary.
+# "separate": a classification call plus one call per persona/category target.
+# Combined mode falls back to separate calls for whatever its response got wrong.
+LLM_SUMMARY_MODE = os.getenv("LLM_SUMMARY_MODE", "combined")
+JSON_OUTPUT = {"response_mime_type": "application/json"}
+# Part of every cache key: bump when the matching prompt template changes
+CLASSIFY_PROMPT_VERSION = "classify-v1"
+SUMMARY_PROMPT_VERSION = "summary-v2"
+COMBINED_PROMPT_VERSION = "combined-v1"
+FALLBACK_TARGETS = [{"persona": "builders", "category": "Models"}]
 
-    try:
-        model = genai.GenerativeModel('gemini-2.5-flash')
-    except Exception as e:
-        logger.error(f"Error creating model: {e}")
-        return None
-    
-    prompt = f"""
-    You are an expert AI analyst. Analyze the following news items and generate a summary for the '{persona.value}' persona, specifically under the category '{category}'.
-    
-    Input Text:
-    {story_text}
-    
-    Output must be strict JSON with the following schema:
-    
-    If Persona is BUILDERS (Technical/Developer focus):
-    {{
+# Output schema per persona. The example values double as instructions to the model;
+# validate_summary checks responses against the same shapes.
+PERSONA_SCHEMAS = {
+    Persona.builders: {
         "summary_short": "max 40 words",
         "bullets": ["technical specs/architecture", "API/Library changes", "performance metrics", "how to implement"],
         "actionable_next_step": "1 code-centric or implementation line",
         "confidence": "low/med/high"
-    }}
-
-    If Persona is EXECUTORS (Business/Strategic focus):
-    {{
+    },
+    Persona.executors: {
         "why_it_matters": "The strategic 'so what' for decision makers",
         "summary_short": "max 35 words",
         "bullets": ["market impact", "enterprise adoption", "competitive shift", "ROI/Efficiency gains"],
         "confidence": "low/med/high"
-    }}
-
-    If Persona is EXPLORERS (Future/Society/Ethics focus):
-    {{
+    },
+    Persona.explorers: {
         "summary_short": "max 45 words",
         "bullets": ["long-term societal shift", "ethical considerations", "creative possibilities", "impact on human labor"],
         "open_questions": ["1-2 philosophical or future-looking bullets"],
         "confidence": "low/med/high"
-    }}
-    
-    If Persona is THOUGHT_LEADERS (High Signal/Expert focus):
-    {{
+    },
+    Persona.thought_leaders: {
         "summary_short": "max 40 words, very dense and insightful",
         "bullets": ["key arguments", "contrarian points", "mental models", "predictions"],
         "actionable_next_step": "1 insight to apply",
         "confidence": "high"
-    }}
+    },
+}
+PERSONA_FOCUS = {
+    Persona.builders: "Technical/Developer focus",
+    Persona.executors: "Business/Strategic focus",
+    Persona.explorers: "Future/Society/Ethics focus",
+    Persona.thought_leaders: "High Signal/Expert focus",
+}
+
+def schema_text():
+    return "\n\n".join(
+        f"If Persona is {persona.value.upper()} ({PERSONA_FOCUS[persona]}):\n{json.dumps(schema, indent=4)}"
+        for persona, schema in PERSONA_SCHEMAS.items()
+    )
+
+def validate_summary(persona, data):
+    """True if data has every field of the persona's schema, with strings and lists of strings where expected."""
+    if not isinstance(data, dict):
+        return False
+    for field, example in PERSONA_SCHEMAS[persona].items():
+        value = data.get(field)
+        if isinstance(example, list):
+            if not isinstance(value, list) or not all(isinstance(v, str) for v in value):
+                return False
+        elif not isinstance(value, str) or not value.strip():
+            return False
+    return True
+
+async def generate_summary(story_text, persona: Persona, category: str, model=None):
+    if not api_key:
+        logger.warning("GEMINI_API_KEY not set. Skipping summarization.")
+        return None
+
+    prompt = f"""
+    You are an expert AI analyst. Analyze the following news items and generate a summary for the '{persona.value}' persona, specifically under the category '{category}'.
+    
+    Input Text:
+    {story_text}
+    
+    Output must be strict JSON with the following schema:
+    
+{schema_text()}
     
     Critical rule: Focus purely on the {persona.value} perspective and the {category} context. Do not invent.
     """
     
-    try:
-        response = await model.generate_content_async(prompt)
-        text = response.text
-        # Clean up json markdown if present
-        text = text.replace("```json", "").replace("```", "")
-        data = json.loads(text)
-        return data
-    except Exception as e:
-        logger.error(f"LLM Error: {e}")
-        if "404" in str(e) or "not found" in str(e):
-             logger.info("listing available models...")
-             for m in genai.list_models():
-                 logger.info(f"Model: {m.name}")
-        return None
+    async def compute():
+        nonlocal model
+        if model is None:
+            try:
+                model = genai.GenerativeModel(MODEL_NAME)
+            except Exception as e:
+                logger.error(f"Error creating model: {e}")
+                return None
 
-async def summarize_stories():
-    async with SessionLocal() as session:
-        from sqlalchemy import func
+        try:
+            response = await generate_content(model, prompt)
+            text = response.text
+            # Clean up json markdown if present
+            text = text.replace("```json", "").replace("```", "")
+            return json.loads(text)
+        except Exception as e:
+            logger.error(f"LLM Error: {e}")
+            if "404" in str(e) or "not found" in str(e):
+                 logger.info("listing available models...")
+                 for m in genai.list_models():
+                     logger.info(f"Model: {m.name}")
+            return None
 
-        # Get stories without 3 summaries, but only the Top 15 by signal strength
-        # To avoid wasting tokens on old or low-interest items
-        stmt = (
-            select(Story)
-            .outerjoin(Story.items)
-            .group_by(Story.id)
-            .options(selectinload(Story.items), selectinload(Story.summaries))
-            .order_by(func.count(Story.items.property.mapper.class_.id).desc(), Story.created_at.desc())
-            .limit(50)
-        )
-        
-        result = await session.execute(stmt)
-        stories = result.scalars().unique().all()
-        
-        model = genai.GenerativeModel('gemini-2.5-flash')
+    key = llm_cache.cache_key(MODEL_NAME, SUMMARY_PROMPT_VERSION, persona.value, category, story_text)
+    return await llm_cache.cached("summary", MODEL_NAME, key, compute)
 
-        for story in stories:
-            # Gather existing personas
-            existing_personas = {s.persona for s in story.summaries}
-            
-            # Prepare story text for classification
-            if not story.items:
-                continue
-                
-            story_context = f"Title: {story.canonical_title}\n"
-            for i in story.items[:3]:
-                story_context += f"- {i.title}: {i.raw_text[:300] if i.raw_text else ''}\n"
-
-            # Decide which personas/categories this is relevant for
-            relevance_prompt = f"""
+async def classify_story(model, story):
+    """Pick the persona/category targets for a story (at most 2). None if the call failed."""
+    story_context = f"Title: {story.canonical_title}\n"
+    for i in story.items[:3]:
+        story_context += f"- {i.title}: {(i.excerpt or i.body)[:300]}\n"
+
+    # Decide which personas/categories this is relevant for
+    relevance_prompt = f"""
 Given this AI news story, classify it into the most relevant PERSONAS and CATEGORIES.
 Hierarchy:
 {json.dumps(HIERARCHY, indent=2)}
@@ -147,56 +165,234 @@ Return strict JSON:
     ]
 }}
 """
-            try:
-                response = await model.generate_content_async(relevance_prompt)
-                text = response.text.replace("```json", "").replace("```", "")
-                result = json.loads(text)
-                targets = result.get("classifications", [])
+    async def compute():
+        try:
+            response = await generate_content(model, relevance_prompt)
+            text = response.text.replace("```json", "").replace("```", "")
+            result = json.loads(text)
+            targets = result.get("classifications", [])
+            logger.info(f"Target classifications for {story.id}: {targets}")
+            return targets
+        except Exception as e:
+            # None isn't cached: the caller's fallback is retried next run
+            logger.error(f"Relevance check failed: {e}. Using fallback...")
+            return None
+
+    key = llm_cache.cache_key(MODEL_NAME, CLASSIFY_PROMPT_VERSION, story_context)
+    return await llm_cache.cached("classify", MODEL_NAME, key, compute)
+
+def build_summary(story, persona, category, data):
+    new_summary = StorySummary(
+        story_id=story.id,
+        persona=persona,
+        category=category,
+        summary_short=data.get("summary_short", ""),
+        summary_bullets=data.get("bullets", []),
+        why_it_matters=data.get("why_it_matters", "") if persona == Persona.executors else "",
+        confidence=data.get("confidence", "low")
+    )
+    
+    if persona == Persona.builders and "actionable_next_step" in data:
+         new_summary.key_entities = [data["actionable_next_step"]]
+    elif persona == Persona.explorers and "open_questions" in data:
+         new_summary.key_entities = data["open_questions"]
+    elif persona == Persona.thought_leaders and "actionable_next_step" in data:
+         new_summary.key_entities = [data["actionable_next_step"]]
+    return new_summary
+
+async def generate_story_summaries(model, story_text, targets=None, existing=()):
+    """One structured-output call for a story: classification plus a summary per target.
+
+    With targets, the model only writes those summaries. existing lists persona/category pairs
+    that already have a summary, so none is written for them. Returns (classifications,
+    {(persona, category): data}) holding only summaries that match their persona's schema,
+    or None if the call or its JSON failed.
+    """
+    if targets is None:
+        task = f"""Classify this AI news story into the most relevant PERSONAS and CATEGORIES, then write a summary for each.
+Hierarchy:
+{json.dumps(HIERARCHY, indent=2)}"""
+        rules = [
+            "Pick at most 2 Personas.",
+            "For each Persona, pick exactly 1 relevant Category from the hierarchy.",
+        ]
+    else:
+        task = f"""Write a summary of this AI news story for each of these PERSONAS and CATEGORIES:
+{json.dumps(targets)}"""
+        rules = ["Return exactly these Personas and Categories as the classifications."]
+    rules.append("Each summary follows its Persona's schema below and focuses purely on that Persona's perspective and the Category's context. Do not invent.")
+    if existing:
+        rules.append(f"Do not write summaries for these persona/category pairs, they already exist: {json.dumps(existing)}")
+    rules_text = "\n".join(f"{n}. {rule}" for n, rule in enumerate(rules, 1))
+
+    prompt = f"""
+You are an expert AI analyst. {task}
+
+Rules:
+{rules_text}
+
+Summary schemas:
+{schema_text()}
+
+Input Text:
+{story_text}
+
+Return strict JSON:
+{{
+    "classifications": [
+        {{"persona": "builders", "category": "Models"}},
+        ...
+    ],
+    "summaries": [
+        {{"persona": "builders", "category": "Models", "summary": {{...fields from the builders schema...}}}},
+        ...
+    ]
+}}
+"""
+    async def compute():
+        try:
+            response = await generate_content(model, prompt, generation_config=JSON_OUTPUT)
+            text = response.text.replace("```json", "").replace("```", "")
+            result = json.loads(text)
+            if not isinstance(result.get("classifications"), list) or not isinstance(result.get("summaries"), list):
+                raise ValueError("missing classifications or summaries")
+            return result
+        except Exception as e:
+            logger.error(f"Combined summarization failed: {e}. Using separate calls...")
+            return None
+
+    key = llm_cache.cache_key(MODEL_NAME, COMBINED_PROMPT_VERSION, json.dumps(targets), json.dumps(existing), story_text)
+    result = await llm_cache.cached("story", MODEL_NAME, key, compute)
+    if result is None:
+        return None
+
+    summaries = {}
+    for entry in result["summaries"]:
+        if not isinstance(entry, dict):
+            continue
+        try:
+            persona = Persona(entry.get("persona"))
+        except ValueError:
+            continue
+        data = entry.get("summary")
+        if validate_summary(persona, data):
+            summaries[(persona, entry.get("category"))] = data
+    classifications = [target for target in result["classifications"] if isinstance(target, dict)]
+    return classifications, summaries
+
+def missing_targets(story, targets):
+    """(persona, category) pairs among targets that the story has no summary for yet."""
+    wanted = []
+    for target in targets:
+        persona_val = target.get("persona")
+        category = target.get("category")
+        
+        try:
+            persona = Persona(persona_val)
+        except ValueError:
+            continue
+
+        # Check if this specific persona/category combo already exists
+        existing = any(s.persona == persona and s.category == category for s in story.summaries)
+        if existing or (persona, category) in wanted:
+            continue
+        wanted.append((persona, category))
+    return wanted
+
+async def summarize_story(model, story):
+    """LLM work for one story: classify, then generate the missing summaries.
+
+    Touches no database session or story attributes; returns (classification, summaries): the
+    fresh classification to persist (None if the stored one was reused or the call failed) and
+    the new (unsaved) StorySummary rows. A story keeps its classification until its membership
+    changes, so settled stories cost no calls at all.
+    """
+    classification = None
+    targets = None
+    if story.classification is not None and story.classification_key == item_set_key(story):
+        targets = story.classification
+        if not missing_targets(story, targets):
+            return None, []
+
+    story_text = build_story_text(story)
+    generated = {}
+    if LLM_SUMMARY_MODE == "combined":
+        logger.info(f"Generating summaries for story {story.id} in one call")
+        existing = sorted({f"{s.persona.value}/{s.category}" for s in story.summaries})
+        result = await generate_story_summaries(model, story_text, targets, existing)
+        if result is not None:
+            classifications, generated = result
+            if targets is None:
+                classification = targets = classifications
                 logger.info(f"Target classifications for {story.id}: {targets}")
-            except Exception as e:
-                logger.error(f"Relevance check failed: {e}. Using fallback...")
-                targets = [{"persona": "builders", "category": "Models"}]
-
-            for target in targets:
-                persona_val = target.get("persona")
-                category = target.get("category")
-                
-                try:
-                    persona = Persona(persona_val)
-                except ValueError:
-                    continue
-
-                # Check if this specific persona/category combo already exists
-                existing = any(s.persona == persona and s.category == category for s in story.summaries)
-                if existing:
-                    continue
-                
-                logger.info(f"Generating {persona.value}/{category} summary for story {story.id}")
-                story_text = "\n\n".join([f"Title: {i.title}\nUrl: {i.url}\nText: {i.raw_text}" for i in story.items[:5]])
-                data = await generate_summary(story_text, persona, category)
-                
-                if data:
-                    new_summary = StorySummary(
-                        story_id=story.id,
-                        persona=persona,
-                        category=category,
-                        summary_short=data.get("summary_short", ""),
-                        summary_bullets=data.get("bullets", []),
-                        why_it_matters=data.get("why_it_matters", "") if persona == Persona.executors else "",
-                        confidence=data.get("confidence", "low")
-                    )
-                    
-                    if persona == Persona.builders and "actionable_next_step" in data:
-                         new_summary.key_entities = [data["actionable_next_step"]]
-                    elif persona == Persona.explorers and "open_questions" in data:
-                         new_summary.key_entities = data["open_questions"]
-                    elif persona == Persona.thought_leaders and "actionable_next_step" in data:
-                         new_summary.key_entities = [data["actionable_next_step"]]
-
-                    session.add(new_summary)
+
+    if targets is None:
+        classification = await classify_story(model, story)
+        # The fallback is not persisted, so the next run asks again
+        targets = classification if classification is not None else FALLBACK_TARGETS
+
+    wanted = missing_targets(story, targets)
+    # Separate calls for whatever the combined response skipped or got wrong
+    remaining = [target for target in wanted if target not in generated]
+    for persona, category in remaining:
+        logger.info(f"Generating {persona.value}/{category} summary for story {story.id}")
+    results = await asyncio.gather(*(generate_summary(story_text, persona, category, model) for persona, category in remaining))
+    generated.update({target: data for target, data in zip(remaining, results) if data})
+    return classification, [build_summary(story, persona, category, generated[(persona, category)]) for persona, category in wanted if (persona, category) in generated]
+
+async def summarize_stories(run_id=None):
+    """Summarize the top stories. With a pipeline run_id, stories that run already finished are skipped.
+
+    Stories are summarized concurrently (LLM_CONCURRENCY at a time, all calls under the shared
+    rate limits); results are written and checkpointed one story at a time as they finish.
+    """
+    async with SessionLocal() as session:
+        # Only the top stories by ranking score (signal, trust and recency)
+        # To avoid wasting tokens on old or low-interest items
+        stmt = (
+            select(Story)
+            .options(
+                selectinload(Story.items).undefer(Item.body_compressed),
+                selectinload(Story.items).selectinload(Item.source),
+                selectinload(Story.summaries)
+            )
+            .order_by(Story.score.desc())
+            .limit(50)
+        )
+        
+        result = await session.execute(stmt)
+        stories = result.scalars().unique().all()
+
+        if run_id:
+            done = await pipeline.completed_units(session, run_id, "summarize")
+            await pipeline.start_stage(session, run_id, "summarize", len(stories))
+            await session.commit()
+            stories = [s for s in stories if str(s.id) not in done]
+        
+        model = genai.GenerativeModel(MODEL_NAME)
+        semaphore = asyncio.Semaphore(LLM_CONCURRENCY)
+
+        async def job(story):
+            async with semaphore:
+                return story, *await summarize_story(model, story)
+
+        # Stories without items have nothing to summarize
+        jobs = [job(story) for story in stories if story.items]
+        for finished in asyncio.as_completed(jobs):
+            story, classification, new_summaries = await finished
+            # Set here, not in the job: changes made while another story's commit is in flight are lost
+            if classification is not None:
+                story.classification = classification
+                story.classification_key = item_set_key(story)
+            session.add_all(new_summaries)
             
+            if run_id:
+                await pipeline.mark_done(session, run_id, "summarize", story.id)
             await session.commit()
 
+    await llm_cache.evict()
+    llm_cache.log_stats()
+
 if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO)
     asyncio.run(summarize_stories())
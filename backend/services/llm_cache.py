@@ -0,0 +1,103 @@
+import os
+import re
+import hashlib
+import logging
+from datetime import datetime, timedelta
+from sqlalchemy import delete, update
+from sqlalchemy.future import select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from ..database import SessionLocal
+from ..models import LLMCacheEntry
+from .feed_parsing import to_naive_utc
+
+logger = logging.getLogger(__name__)
+
+# Content-addressed cache of parsed LLM responses. The same model, prompt version and input
+# always map to the same key, so unchanged stories cost no API call. Bump a prompt's version
+# constant whenever its template changes.
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() != "false"
+LLM_CACHE_TTL_HOURS = float(os.getenv("LLM_CACHE_TTL_HOURS", str(7 * 24)))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "20000"))
+
+# Per-process counters, logged after each summarization run
+stats = {"hits": 0, "misses": 0}
+
+_whitespace = re.compile(r"\s+")
+
+def cache_key(model, prompt_version, *inputs):
+    normalized = "\x1f".join(_whitespace.sub(" ", str(part)).strip() for part in inputs)
+    return hashlib.sha256(f"{model}\x1e{prompt_version}\x1e{normalized}".encode()).hexdigest()
+
+async def get(key):
+    """The cached response, or None on a miss or an expired entry."""
+    if not LLM_CACHE_ENABLED:
+        return None
+    async with SessionLocal() as session:
+        entry = await session.get(LLMCacheEntry, key)
+        now = datetime.utcnow()
+        if entry is None or to_naive_utc(entry.created_at) < now - timedelta(hours=LLM_CACHE_TTL_HOURS):
+            stats["misses"] += 1
+            return None
+        await session.execute(
+            update(LLMCacheEntry)
+            .where(LLMCacheEntry.key == key)
+            .values(last_used_at=now, hits=LLMCacheEntry.hits + 1)
+        )
+        await session.commit()
+        stats["hits"] += 1
+        return entry.response
+
+async def put(key, kind, model, response):
+    if not LLM_CACHE_ENABLED:
+        return
+    async with SessionLocal() as session:
+        insert = pg_insert if session.get_bind().dialect.name == "postgresql" else sqlite_insert
+        now = datetime.utcnow()
+        stmt = insert(LLMCacheEntry).values(
+            key=key, kind=kind, model=model, response=response, created_at=now, last_used_at=now, hits=0
+        )
+        # Concurrent jobs can compute the same key; the later response wins
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["key"],
+            set_={"response": stmt.excluded.response, "created_at": now, "last_used_at": now}
+        )
+        await session.execute(stmt)
+        await session.commit()
+
+async def cached(kind, model, key, compute):
+    """Return the cached response for key, or await compute() and cache it unless it is None."""
+    response = await get(key)
+    if response is not None:
+        return response
+    response = await compute()
+    if response is not None:
+        await put(key, kind, model, response)
+    return response
+
+async def evict():
+    """Drop expired entries, then the least recently used ones beyond LLM_CACHE_MAX_ENTRIES."""
+    async with SessionLocal() as session:
+        expired = datetime.utcnow() - timedelta(hours=LLM_CACHE_TTL_HOURS)
+        result = await session.execute(delete(LLMCacheEntry).where(LLMCacheEntry.created_at < expired))
+        removed = result.rowcount or 0
+
+        cutoff = await session.execute(
+            select(LLMCacheEntry.last_used_at)
+            .order_by(LLMCacheEntry.last_used_at.desc())
+            .offset(LLM_CACHE_MAX_ENTRIES)
+            .limit(1)
+        )
+        oldest_kept = cutoff.scalar()
+        if oldest_kept is not None:
+            result = await session.execute(delete(LLMCacheEntry).where(LLMCacheEntry.last_used_at <= oldest_kept))
+            removed += result.rowcount or 0
+        await session.commit()
+    if removed:
+        logger.info(f"LLM cache: evicted {removed} entries")
+    return removed
+
+def log_stats():
+    total = stats["hits"] + stats["misses"]
+    rate = stats["hits"] / total if total else 0.0
+    logger.info(f"LLM cache: {stats['hits']} hits, {stats['misses']} misses ({rate:.0%} hit rate)")
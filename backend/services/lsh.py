@@ -0,0 +1,86 @@
+import hashlib
+import re
+import struct
+from collections import defaultdict
+from functools import lru_cache
+
+# MinHash LSH over character shingles of normalized titles.
+# 48 bands x 3 rows: a pair becomes a candidate with probability 1 - (1 - J^3)^48 for shingle-Jaccard J,
+# ~73% at J=0.3, ~32% at J=0.2, ~5% at J=0.1. Measured on the benchmark corpus (1,500 titles against
+# each other): 88 candidates per title (5.8%, down from 13.3% with 32x2) and 9.3% of the pairs with
+# SequenceMatcher >= 0.65 missed (3.2% with 32x2). Stories gain every member's bands, so a variant
+# only has to collide with one of them: end-to-end pair recall on 10k items was unchanged (0.38 vs
+# 0.37) and clustering ran 2x faster.
+# Everything here must be stable across processes and restarts (band keys are persisted), so no
+# use of Python's salted hash(). Bump LSH_VERSION whenever the banding changes; stored bands from
+# another version are rebuilt (story_index.reband).
+NUM_BANDS = 48
+ROWS_PER_BAND = 3
+LSH_VERSION = 2
+NUM_PERM = NUM_BANDS * ROWS_PER_BAND
+SHINGLE_SIZE = 3
+
+_MAX_HASH = (1 << 32) - 1
+_perm_values = struct.Struct(f"<{NUM_PERM}I")
+
+_non_word = re.compile(r"[^a-z0-9]+")
+
+def normalize_title(title):
+    return _non_word.sub(" ", (title or "").lower()).strip()
+
+def shingles(text):
+    if len(text) <= SHINGLE_SIZE:
+        return {text} if text else set()
+    return {text[i:i + SHINGLE_SIZE] for i in range(len(text) - SHINGLE_SIZE + 1)}
+
+@lru_cache(maxsize=65536)
+def _shingle_hashes(shingle):
+    # NUM_PERM independent 32-bit hashes in one C call; shingles repeat heavily across titles
+    return _perm_values.unpack(hashlib.shake_128(shingle.encode()).digest(NUM_PERM * 4))
+
+def minhash(text):
+    found = shingles(text)
+    if not found:
+        return [_MAX_HASH] * NUM_PERM
+    # Column-wise min over the shingles' hash vectors, all in C
+    return list(map(min, zip(*map(_shingle_hashes, found))))
+
+_band_rows = struct.Struct(f"<H{ROWS_PER_BAND}I")
+
+def band_keys(signature):
+    """One stable 63-bit bucket key per band."""
+    keys = []
+    for band in range(NUM_BANDS):
+        rows = signature[band * ROWS_PER_BAND:(band + 1) * ROWS_PER_BAND]
+        digest = hashlib.blake2b(_band_rows.pack(band, *rows), digest_size=8).digest()
+        keys.append(int.from_bytes(digest, "big") >> 1) # Fits a signed BIGINT / JSON int
+    return keys
+
+def title_bands(title):
+    return band_keys(minhash(normalize_title(title)))
+
+class LSHIndex:
+    """Band bucket -> keys. Candidates are keys that share at least one bucket with the query."""
+
+    def __init__(self):
+        self.buckets = defaultdict(set)
+
+    def add(self, key, bands):
+        for band in bands:
+            self.buckets[band].add(key)
+
+    def remove(self, key, bands):
+        for band in bands:
+            bucket = self.buckets.get(band)
+            if bucket:
+                bucket.discard(key)
+                if not bucket:
+                    del self.buckets[band]
+
+    def candidates(self, bands):
+        found = set()
+        for band in bands:
+            bucket = self.buckets.get(band)
+            if bucket:
+                found |= bucket
+        return found
@@ -0,0 +1,44 @@
+import hashlib
+import re
+import zlib
+from bs4 import BeautifulSoup
+
+EXCERPT_CHARS = 600 # Enough for classification prompts and previews
+
+_whitespace = re.compile(r"\s+")
+
+def html_to_text(html):
+    """Strip feed HTML down to readable plain text with collapsed whitespace."""
+    if not html:
+        return ""
+    if "<" in html or "&" in html:
+        html = BeautifulSoup(html, "html.parser").get_text(" ")
+    return _whitespace.sub(" ", html).strip()
+
+def make_excerpt(text, limit=EXCERPT_CHARS):
+    if len(text) <= limit:
+        return text
+    # Cut on a word boundary
+    return text[:limit].rsplit(" ", 1)[0] + "…"
+
+def content_fingerprint(text):
+    return hashlib.sha1(text.lower().encode()).hexdigest()
+
+def compress_text(text):
+    return zlib.compress(text.encode(), 6) if text else None
+
+def decompress_text(blob):
+    return zlib.decompress(blob).decode() if blob else ""
+
+def normalize_content(html):
+    """Raw feed HTML -> the Item columns that store it."""
+    text = html_to_text(html)
+    return {
+        "excerpt": make_excerpt(text),
+        "body_compressed": compress_text(text),
+        "content_fingerprint": content_fingerprint(text) if text else None,
+    }
+
+def normalize_contents(htmls):
+    """normalize_content over a feed's new entries; one picklable call for the parse workers."""
+    return [normalize_content(html) for html in htmls]
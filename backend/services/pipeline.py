@@ -0,0 +1,96 @@
+import os
+import logging
+from datetime import datetime, timedelta
+from sqlalchemy import update, func
+from sqlalchemy.future import select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from ..database import SessionLocal
+from ..models import PipelineRun, PipelineCheckpoint
+from .feed_parsing import to_naive_utc
+
+logger = logging.getLogger(__name__)
+
+# Crashed runs older than this are abandoned instead of resumed
+RESUME_WINDOW_HOURS = float(os.getenv("PIPELINE_RESUME_WINDOW_HOURS", "12"))
+
+async def start_or_resume_run():
+    """Return (run_id, resumed). Picks up the latest crashed run if it is recent enough.
+
+    Only "running" runs (the process died mid-run) are resumed. A run that raised is "failed"
+    and stays that way: resuming it would make every following run retry the failing stage and
+    skip the sources it had already checkpointed.
+    """
+    async with SessionLocal() as session:
+        result = await session.execute(
+            select(PipelineRun)
+            .where(PipelineRun.status == "running")
+            .order_by(PipelineRun.started_at.desc())
+            .limit(1)
+        )
+        run = result.scalars().first()
+
+        cutoff = datetime.utcnow() - timedelta(hours=RESUME_WINDOW_HOURS)
+        if run and to_naive_utc(run.started_at) >= cutoff:
+            logger.info(f"Resuming pipeline run {run.id} at stage {run.current_stage}")
+            return run.id, True
+
+        # Anything older is stale: start over rather than resume it
+        await session.execute(
+            update(PipelineRun)
+            .where(PipelineRun.status == "running")
+            .values(status="abandoned", finished_at=func.now())
+        )
+        run = PipelineRun(status="running", stage_totals={})
+        session.add(run)
+        await session.commit()
+        logger.info(f"Started pipeline run {run.id}")
+        return run.id, False
+
+async def start_stage(session, run_id, stage, total):
+    run = await session.get(PipelineRun, run_id)
+    run.current_stage = stage
+    # Reassign so the JSON column is flagged dirty
+    run.stage_totals = {**(run.stage_totals or {}), stage: total}
+
+async def completed_units(session, run_id, stage):
+    result = await session.execute(
+        select(PipelineCheckpoint.unit_key).where(
+            PipelineCheckpoint.run_id == run_id, PipelineCheckpoint.stage == stage
+        )
+    )
+    return set(result.scalars().all())
+
+async def mark_done(session, run_id, stage, unit_key):
+    """Record a finished unit of work. Commit it together with the unit's own writes.
+
+    Idempotent: a resumed run (or a second process that picked up the same run) can finish a unit
+    that is already recorded, e.g. the empty clustering batch.
+    """
+    insert = pg_insert if session.get_bind().dialect.name == "postgresql" else sqlite_insert
+    await session.execute(
+        insert(PipelineCheckpoint)
+        .values(run_id=run_id, stage=stage, unit_key=str(unit_key))
+        .on_conflict_do_nothing(index_elements=["run_id", "stage", "unit_key"])
+    )
+
+async def finish_run(run_id, status="completed"):
+    async with SessionLocal() as session:
+        await session.execute(
+            update(PipelineRun)
+            .where(PipelineRun.id == run_id)
+            .values(status=status, finished_at=func.now())
+        )
+        await session.commit()
+
+async def run_progress(session, run_ids):
+    """{run_id: {stage: completed units}} for the given runs."""
+    result = await session.execute(
+        select(PipelineCheckpoint.run_id, PipelineCheckpoint.stage, func.count())
+        .where(PipelineCheckpoint.run_id.in_(run_ids))
+        .group_by(PipelineCheckpoint.run_id, PipelineCheckpoint.stage)
+    )
+    progress = {}
+    for run_id, stage, count in result.all():
+        progress.setdefault(run_id, {})[stage] = count
+    return progress
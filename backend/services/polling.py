@@ -0,0 +1,61 @@
+import os
+import random
+import logging
+from datetime import datetime, timedelta
+from statistics import median
+from sqlalchemy.future import select
+from sqlalchemy import or_
+from ..models import Source, Item
+
+logger = logging.getLogger(__name__)
+
+# Bounds for the learned per-source interval, in minutes
+MIN_POLL_MINUTES = float(os.getenv("MIN_POLL_MINUTES", "15"))
+MAX_POLL_MINUTES = float(os.getenv("MAX_POLL_MINUTES", str(24 * 60)))
+DEFAULT_POLL_MINUTES = float(os.getenv("DEFAULT_POLL_MINUTES", "60"))
+POLL_JITTER = 0.1 # +/- 10% so sources learned to the same cadence don't fire together
+CADENCE_HISTORY = 20 # Recent items used to estimate how often a source publishes
+
+async def estimate_interval(session, source_id):
+    """Poll at half the median gap between a source's recent posts, clamped to sane bounds."""
+    result = await session.execute(
+        select(Item.published_at)
+        .where(Item.source_id == source_id, Item.published_at != None)
+        .order_by(Item.published_at.desc())
+        .limit(CADENCE_HISTORY)
+    )
+    published = result.scalars().all()
+    if len(published) < 3:
+        return DEFAULT_POLL_MINUTES
+
+    gaps = [(a - b).total_seconds() / 60 for a, b in zip(published, published[1:])]
+    gaps = [g for g in gaps if g > 0] # Batch-published feeds (arXiv) share timestamps
+    if not gaps:
+        return DEFAULT_POLL_MINUTES
+    return min(max(median(gaps) / 2, MIN_POLL_MINUTES), MAX_POLL_MINUTES)
+
+async def record_poll(session, source, failed=False, new_items=0):
+    """Schedule a source's next poll after a fetch. Caller commits."""
+    if new_items or source.poll_interval_minutes is None:
+        source.poll_interval_minutes = await estimate_interval(session, source.id)
+
+    interval = source.poll_interval_minutes
+    if failed:
+        # Exponential backoff on errors/bozo feeds, reset by the next clean fetch
+        source.consecutive_failures = (source.consecutive_failures or 0) + 1
+        interval = min(interval * 2 ** source.consecutive_failures, MAX_POLL_MINUTES)
+    else:
+        source.consecutive_failures = 0
+
+    interval *= random.uniform(1 - POLL_JITTER, 1 + POLL_JITTER)
+    source.next_poll_at = datetime.utcnow() + timedelta(minutes=interval)
+    logger.info(f"Next poll of {source.name} in {interval:.0f} min")
+
+async def due_source_ids(session):
+    result = await session.execute(
+        select(Source.id).where(
+            Source.feed_url != None,
+            or_(Source.next_poll_at == None, Source.next_poll_at <= datetime.utcnow())
+        )
+    )
+    return list(result.scalars().all())
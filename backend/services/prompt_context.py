@@ -0,0 +1,117 @@
+import os
+import re
+import hashlib
+import logging
+from collections import OrderedDict
+from datetime import datetime
+from ..models import TrustLevel
+from .feed_parsing import to_naive_utc
+from .ranking import TRUST_WEIGHTS, RANK_HALF_LIFE_HOURS
+from .rate_limit import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+# Story text sent to the LLM, held to a token budget. Items get a share of the budget by trust
+# and recency; a sentence already quoted by a better item is dropped, since wire copy and
+# newsletters repeat each other. Prompt size stays bounded however long the sources are.
+LLM_CONTEXT_TOKENS = int(os.getenv("LLM_CONTEXT_TOKENS", "3000"))
+CONTEXT_MAX_ITEMS = 5
+CONTEXT_CACHE_SIZE = 512 # Built contexts kept per process
+
+_sentence_end = re.compile(r"(?<=[.!?])\s+")
+_non_word = re.compile(r"[^\w]+")
+_cache = OrderedDict()
+
+def item_set_key(story):
+    """Hash of the story's member ids: changes exactly when items join or leave."""
+    ids = sorted(str(i.id) for i in story.items)
+    return hashlib.sha256(",".join(ids).encode()).hexdigest()
+
+def sentence_key(sentence):
+    return _non_word.sub(" ", sentence.lower()).strip()
+
+def item_weight(item, newest):
+    """Trust weight, halved for every RANK_HALF_LIFE_HOURS the item is older than the story's newest."""
+    trust_level = item.source.trust_level if item.source else None
+    weight = TRUST_WEIGHTS.get(trust_level, TRUST_WEIGHTS[TrustLevel.medium])
+    published = to_naive_utc(item.published_at)
+    if published and newest:
+        hours = max(0.0, (newest - published).total_seconds() / 3600)
+        weight *= 0.5 ** (hours / RANK_HALF_LIFE_HOURS)
+    return weight
+
+def allocate(budget, weights, needs):
+    """Split budget in proportion to weights, handing what an item doesn't need to the rest."""
+    shares = [0] * len(weights)
+    open_items = [i for i, need in enumerate(needs) if need > 0]
+    while budget > 0 and open_items:
+        total = sum(weights[i] for i in open_items)
+        spent = 0
+        for i in open_items:
+            grant = min(needs[i] - shares[i], int(budget * weights[i] / total))
+            shares[i] += grant
+            spent += grant
+        if not spent:
+            break # What is left is too small to split further
+        budget -= spent
+        open_items = [i for i in open_items if shares[i] < needs[i]]
+    return shares
+
+def fit(sentences, tokens):
+    """Leading sentences within `tokens`; a first sentence that alone is too long gets cut."""
+    kept = []
+    used = 0
+    for sentence in sentences:
+        cost = estimate_tokens(sentence + " ")
+        if used + cost > tokens:
+            if not kept and tokens > 0:
+                kept.append(sentence[:tokens * 4])
+            break
+        kept.append(sentence)
+        used += cost
+    return " ".join(kept)
+
+def build_story_text(story, budget=None):
+    """Story text for LLM prompts within `budget` tokens (LLM_CONTEXT_TOKENS by default).
+
+    Needs the story's items loaded with their source and body_compressed. Cached per story and
+    item set, so an unchanged story is built once per process.
+    """
+    budget = budget or LLM_CONTEXT_TOKENS
+    key = (story.id, item_set_key(story), budget)
+    if key in _cache:
+        _cache.move_to_end(key)
+        return _cache[key]
+
+    published = [to_naive_utc(i.published_at) for i in story.items if i.published_at]
+    newest = max(published) if published else datetime.utcnow()
+    weighted = sorted(
+        ((item_weight(i, newest), i) for i in story.items),
+        key=lambda wi: (-wi[0], str(wi[1].id))
+    )[:CONTEXT_MAX_ITEMS]
+
+    # Most trusted, freshest items first, so they keep the sentences sources share
+    seen = set()
+    headers, bodies = [], []
+    for _, item in weighted:
+        headers.append(f"Title: {item.title}\nUrl: {item.url}\nText: ")
+        sentences = []
+        for sentence in _sentence_end.split(item.body or item.excerpt or ""):
+            sentence = sentence.strip()
+            skey = sentence_key(sentence)
+            if not skey or skey in seen:
+                continue
+            seen.add(skey)
+            sentences.append(sentence)
+        bodies.append(sentences)
+
+    remaining = budget - sum(estimate_tokens(h) for h in headers)
+    needs = [sum(estimate_tokens(s + " ") for s in sentences) for sentences in bodies]
+    shares = allocate(remaining, [w for w, _ in weighted], needs)
+    text = "\n\n".join(header + fit(sentences, share) for header, sentences, share in zip(headers, bodies, shares))
+
+    logger.debug(f"Story {story.id} context: ~{estimate_tokens(text)} tokens from {len(weighted)} items (budget {budget})")
+    _cache[key] = text
+    if len(_cache) > CONTEXT_CACHE_SIZE:
+        _cache.popitem(last=False)
+    return text
@@ -0,0 +1,71 @@
+import os
+import math
+import logging
+from collections import defaultdict
+from datetime import datetime
+from sqlalchemy import update, func
+from sqlalchemy.future import select
+from ..models import Item, Source, Story, TrustLevel
+from .feed_parsing import to_naive_utc
+
+logger = logging.getLogger(__name__)
+
+# Story.score is a "hot" score kept up to date as clustering assigns items:
+#   log(signal) + created_at / tau
+# Decay is folded into the creation-time term, so scores never need recomputing as time passes
+# and ORDER BY score DESC on an index is the ranking. A story RANK_HALF_LIFE_HOURS newer needs
+# half the signal to rank level.
+RANK_HALF_LIFE_HOURS = float(os.getenv("RANK_HALF_LIFE_HOURS", "12"))
+TRUST_WEIGHTS = {
+    TrustLevel.high: 3.0,
+    TrustLevel.medium: 2.0,
+    TrustLevel.signal: 1.0,
+}
+# Extra items from a source already counted add a little; independent sources add a lot
+REPEAT_ITEM_WEIGHT = 0.25
+RANK_EPOCH = datetime(2024, 1, 1)
+
+def rank_score(signal, created_at):
+    age = ((to_naive_utc(created_at) or datetime.utcnow()) - RANK_EPOCH).total_seconds()
+    return math.log(max(signal, 1e-6)) + age * math.log(2) / (RANK_HALF_LIFE_HOURS * 3600)
+
+def story_signal(source_counts):
+    """Trust-weighted signal from {trust_level: [items per source, ...]}."""
+    signal = 0.0
+    for trust_level, counts in source_counts.items():
+        weight = TRUST_WEIGHTS.get(trust_level, TRUST_WEIGHTS[TrustLevel.medium])
+        signal += sum(weight + REPEAT_ITEM_WEIGHT * (count - 1) for count in counts)
+    return signal
+
+async def update_story_ranks(session, story_ids):
+    """Recompute score, item_count and source_count for the given stories. Caller commits.
+
+    Reads only the touched stories' items (one grouped query per 500 stories), so the cost
+    follows what clustering just changed, not the size of the table.
+    """
+    story_ids = list(story_ids)
+    updates = []
+    for i in range(0, len(story_ids), 500):
+        chunk = story_ids[i:i + 500]
+        result = await session.execute(
+            select(Item.story_id, Source.trust_level, func.count(Item.id))
+            .join(Source, Source.id == Item.source_id)
+            .where(Item.story_id.in_(chunk))
+            .group_by(Item.story_id, Item.source_id, Source.trust_level)
+        )
+        per_story = defaultdict(lambda: defaultdict(list))
+        for story_id, trust_level, count in result.all():
+            per_story[story_id][trust_level].append(count)
+
+        result = await session.execute(select(Story.id, Story.created_at).where(Story.id.in_(chunk)))
+        for story_id, created_at in result.all():
+            source_counts = per_story.get(story_id, {})
+            updates.append({
+                "id": story_id,
+                "score": rank_score(story_signal(source_counts), created_at),
+                "item_count": sum(sum(counts) for counts in source_counts.values()),
+                "source_count": sum(len(counts) for counts in source_counts.values()),
+            })
+    if updates:
+        await session.execute(update(Story), updates)
+    return len(updates)
@@ -0,0 +1,96 @@
+import os
+import time
+import random
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Shared LLM quota: every model call goes through one limiter per event loop
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "8")) # Stories summarized at once
+LLM_REQUESTS_PER_MINUTE = float(os.getenv("LLM_REQUESTS_PER_MINUTE", "60"))
+LLM_TOKENS_PER_MINUTE = float(os.getenv("LLM_TOKENS_PER_MINUTE", "250000"))
+LLM_OUTPUT_TOKENS = 600 # Reserved per call for the response on top of the prompt estimate
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "5"))
+RETRY_BASE_SECONDS = 2.0
+RETRY_MAX_SECONDS = 60.0
+RETRYABLE_CODES = {429, 500, 502, 503, 504}
+
+def estimate_tokens(text):
+    # ~4 characters per token for English prose; close enough for budgeting
+    return len(text) // 4 + 1
+
+class TokenBucket:
+    """`per_minute` units, refilled continuously; a burst can use the whole minute's worth."""
+
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.available = per_minute
+        self.rate = per_minute / 60.0
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.available = min(self.capacity, self.available + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount):
+        self._refill()
+        amount = min(amount, self.capacity) # An oversized request waits for a full bucket, not forever
+        return 0.0 if self.available >= amount else (amount - self.available) / self.rate
+
+    def take(self, amount):
+        self.available -= min(amount, self.capacity)
+
+class RateLimiter:
+    """Requests/min and tokens/min buckets. Waiters are served in arrival order."""
+
+    def __init__(self, requests_per_minute, tokens_per_minute):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.lock = asyncio.Lock()
+
+    async def acquire(self, tokens):
+        async with self.lock:
+            while True:
+                wait = max(self.requests.wait_time(1), self.tokens.wait_time(tokens))
+                if wait <= 0:
+                    self.requests.take(1)
+                    self.tokens.take(tokens)
+                    return
+                await asyncio.sleep(wait)
+
+_limiter = None
+_limiter_loop = None
+
+def get_limiter():
+    # asyncio primitives belong to one loop; scripts call asyncio.run more than once
+    global _limiter, _limiter_loop
+    loop = asyncio.get_running_loop()
+    if _limiter is None or _limiter_loop is not loop:
+        _limiter = RateLimiter(LLM_REQUESTS_PER_MINUTE, LLM_TOKENS_PER_MINUTE)
+        _limiter_loop = loop
+    return _limiter
+
+def is_retryable(error):
+    code = getattr(error, "code", None) # google.api_core errors carry the HTTP status
+    if isinstance(code, int):
+        return code in RETRYABLE_CODES
+    text = str(error).lower()
+    return any(marker in text for marker in ("429", "quota", "rate limit", "503", "unavailable", "500 internal"))
+
+async def generate_content(model, prompt, **kwargs):
+    """model.generate_content_async under the shared rate limits, retried with backoff on 429/5xx."""
+    limiter = get_limiter()
+    cost = estimate_tokens(prompt) + LLM_OUTPUT_TOKENS
+    for attempt in range(LLM_MAX_RETRIES + 1):
+        await limiter.acquire(cost)
+        try:
+            return await model.generate_content_async(prompt, **kwargs)
+        except Exception as e:
+            if attempt == LLM_MAX_RETRIES or not is_retryable(e):
+                raise
+            # Exponential backoff with jitter so concurrent jobs don't retry in lockstep
+            delay = min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * 2 ** attempt) * random.uniform(0.5, 1.0)
+            logger.warning(f"LLM call failed ({e}); retry {attempt + 1}/{LLM_MAX_RETRIES} in {delay:.1f}s")
+            await asyncio.sleep(delay)
@@ -0,0 +1,101 @@
+import os
+import logging
+from datetime import datetime, timedelta
+from sqlalchemy import delete, update, or_
+from sqlalchemy.future import select
+from ..models import Item, Story, StoryIndexEntry
+from .lsh import title_bands, NUM_BANDS, LSH_VERSION
+from .centroid import term_vector
+
+logger = logging.getLogger(__name__)
+
+# Items are only matched against stories created within this window
+STORY_WINDOW_HOURS = int(os.getenv("STORY_WINDOW_HOURS", "72"))
+# Cap on band keys kept per story (NUM_BANDS per member title), so big stories stay compact
+MAX_STORY_BANDS = 4 * NUM_BANDS
+
+def window_start():
+    return datetime.utcnow() - timedelta(hours=STORY_WINDOW_HOURS)
+
+def merge_bands(bands, new_bands):
+    """Union of band keys, oldest first, capped at MAX_STORY_BANDS."""
+    if len(bands) >= MAX_STORY_BANDS:
+        return bands
+    seen = set(bands)
+    merged = list(bands)
+    for band in new_bands:
+        if band not in seen:
+            seen.add(band)
+            merged.append(band)
+            if len(merged) >= MAX_STORY_BANDS:
+                break
+    return merged
+
+async def backfill(session, since):
+    """Index recent stories that predate the index (or were created outside clustering)."""
+    result = await session.execute(
+        select(Story.id, Story.canonical_title, Story.created_at)
+        .outerjoin(StoryIndexEntry, StoryIndexEntry.story_id == Story.id)
+        .where(Story.created_at >= since, StoryIndexEntry.story_id == None)
+    )
+    rows = result.all()
+    for story_id, title, created_at in rows:
+        session.add(StoryIndexEntry(
+            story_id=story_id,
+            canonical_title=title,
+            bands=title_bands(title or ""),
+            centroid=term_vector(title or ""),
+            created_at=created_at,
+            updated_at=datetime.utcnow()
+        ))
+    if rows:
+        logger.info(f"Backfilled story index for {len(rows)} stories")
+
+async def reband(session, since):
+    """Recompute bands for rows stored under another LSH_VERSION, from their members' titles.
+
+    Band keys from different bandings never collide, so stale rows would be invisible to new items.
+    Runs once after a banding change; marks the rows dirty so compaction picks up the new bands.
+    """
+    result = await session.execute(
+        select(StoryIndexEntry.story_id, StoryIndexEntry.canonical_title).where(
+            StoryIndexEntry.created_at >= since,
+            or_(StoryIndexEntry.lsh_version != LSH_VERSION, StoryIndexEntry.lsh_version == None)
+        )
+    )
+    stale = {story_id: title_bands(title or "") for story_id, title in result.all()}
+    if not stale:
+        return
+
+    story_ids = list(stale)
+    for i in range(0, len(story_ids), 500):
+        result = await session.execute(
+            select(Item.story_id, Item.title)
+            .where(Item.story_id.in_(story_ids[i:i + 500]))
+            .order_by(Item.published_at, Item.id)
+        )
+        for story_id, title in result.all():
+            stale[story_id] = merge_bands(stale[story_id], title_bands(title or ""))
+    await session.execute(
+        update(StoryIndexEntry),
+        [{"story_id": story_id, "bands": bands, "lsh_version": LSH_VERSION, "dirty": True} for story_id, bands in stale.items()]
+    )
+    logger.info(f"Rebuilt LSH bands for {len(stale)} stories")
+
+async def load_story_index(session):
+    """Evict entries older than the window, backfill missing ones, and return the rest.
+
+    Rows are plain (story_id, canonical_title, bands, centroid) tuples, ordered by story age.
+    """
+    since = window_start()
+    await session.execute(delete(StoryIndexEntry).where(StoryIndexEntry.created_at < since))
+    await backfill(session, since)
+    await session.flush()
+    await reband(session, since)
+
+    result = await session.execute(
+        select(StoryIndexEntry.story_id, StoryIndexEntry.canonical_title, StoryIndexEntry.bands, StoryIndexEntry.centroid)
+        .where(StoryIndexEntry.created_at >= since)
+        .order_by(StoryIndexEntry.created_at, StoryIndexEntry.story_id)
+    )
+    return result.all()
@@ -0,0 +1,102 @@
+import zlib
+import numpy as np
+from scipy import sparse
+from .lsh import normalize_title, shingles
+
+# Hashed character 3-gram TF-IDF. Scores whole batches with sparse matrix products instead of
+# comparing titles pair by pair in Python.
+N_FEATURES = 1 << 20
+# On big batches, n-grams found in more than this share of titles carry no signal and only make
+# the product matrices dense
+MAX_DF = 0.05
+MAX_DF_MIN_DOCS = 1000
+ROW_CHUNK = 2048 # Rows per sparse product, bounds peak memory
+
+def hashed_counts(titles):
+    rows, cols, vals = [], [], []
+    for row, title in enumerate(titles):
+        grams = shingles(normalize_title(title))
+        for gram in grams:
+            rows.append(row)
+            cols.append(zlib.crc32(gram.encode()) & (N_FEATURES - 1))
+            vals.append(1.0)
+    # Duplicate (row, col) pairs from hash collisions are summed by the constructor
+    return sparse.csr_matrix((vals, (rows, cols)), shape=(len(titles), N_FEATURES), dtype=np.float32)
+
+def tfidf_matrix(titles):
+    counts = hashed_counts(titles)
+    n_docs = counts.shape[0]
+    df = np.bincount(counts.indices, minlength=N_FEATURES)
+    idf = np.log((1 + n_docs) / (1 + df)).astype(np.float32) + 1.0
+    if n_docs >= MAX_DF_MIN_DOCS:
+        idf[df > MAX_DF * n_docs] = 0.0
+
+    matrix = counts @ sparse.diags(idf)
+    matrix.eliminate_zeros()
+    # L2-normalize rows so products are cosine similarities
+    norms = np.sqrt(matrix.multiply(matrix).sum(axis=1)).A1
+    norms[norms == 0] = 1.0
+    return sparse.csr_matrix(sparse.diags(1.0 / norms) @ matrix)
+
+def best_matches(left, right):
+    """Per row of left: (best column in right, its score), -1 where nothing overlaps."""
+    best_col = np.full(left.shape[0], -1, dtype=np.int64)
+    best_score = np.zeros(left.shape[0], dtype=np.float32)
+    if right.shape[0] == 0:
+        return best_col, best_score
+    right_t = right.T.tocsc()
+    for start in range(0, left.shape[0], ROW_CHUNK):
+        scores = (left[start:start + ROW_CHUNK] @ right_t).tocsr()
+        for offset in range(scores.shape[0]):
+            lo, hi = scores.indptr[offset], scores.indptr[offset + 1]
+            if lo == hi:
+                continue
+            row_scores = scores.data[lo:hi]
+            cols = scores.indices[lo:hi]
+            # Thresholded argmax; lowest column wins ties, like the sequential scorer
+            top = row_scores.max()
+            best_col[start + offset] = cols[row_scores == top].min()
+            best_score[start + offset] = top
+    return best_col, best_score
+
+def earlier_neighbours(items, threshold):
+    """For each item, the earlier items (j < i) whose titles score >= threshold, with the scores."""
+    neighbours = [[] for _ in range(items.shape[0])]
+    items_t = items.T.tocsc()
+    for start in range(0, items.shape[0], ROW_CHUNK):
+        scores = (items[start:start + ROW_CHUNK] @ items_t).tocoo()
+        keep = (scores.data >= threshold) & (scores.col < scores.row + start)
+        for row, col, score in zip(scores.row[keep], scores.col[keep], scores.data[keep]):
+            neighbours[start + row].append((int(col), float(score)))
+    return neighbours
+
+def plan_tfidf(item_titles, story_titles, threshold):
+    """Same contract as clustering.plan_sequence, scored with batched TF-IDF cosine similarity."""
+    matrix = tfidf_matrix(list(story_titles) + list(item_titles))
+    stories = matrix[:len(story_titles)]
+    items = matrix[len(story_titles):]
+
+    existing_col, existing_score = best_matches(items, stories)
+    neighbours = earlier_neighbours(items, threshold)
+
+    # Only new stories created in this batch need the sequential pass; item i can join a story
+    # led by an earlier item j, and a story's canonical title is its leader's title
+    story_of_leader = {}
+    assignments = []
+    scores = []
+    for i in range(items.shape[0]):
+        best_position = int(existing_col[i]) if existing_col[i] >= 0 else None
+        best_score = float(existing_score[i])
+        for j, score in sorted(neighbours[i]):
+            if j in story_of_leader and score > best_score:
+                best_score = score
+                best_position = story_of_leader[j]
+
+        if best_position is not None and best_score >= threshold:
+            assignments.append(best_position)
+        else:
+            position = len(story_titles) + len(story_of_leader)
+            story_of_leader[i] = position
+            assignments.append(position)
+        scores.append(best_score)
+    return assignments, scores